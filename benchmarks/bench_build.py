@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time whole Pelican builds of a synthetic site against a local fake Flickr
+server (see ``fakeflickr.py`` and ``sitegen.py``).
+
+Three builds are timed: a cold one with an empty cache, a warm one with
+everything cached, and one after a share of the photos changed on Flickr
+(``--invalidate``), which are found with FLICKR_TAG_CACHE_REFRESH and
+fetched again.
+
+    $ python benchmarks/bench_build.py --documents 200 --tags 10 --latency 0.05
+    $ python benchmarks/bench_build.py --set FLICKR_TAG_FETCH_CONCURRENCY=8
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pelican import Pelican  # noqa: E402
+from pelican.settings import read_settings  # noqa: E402
+
+from pelican_flickrtag import flickr, plugin  # noqa: E402
+
+import fakeflickr  # noqa: E402
+import sitegen  # noqa: E402
+
+
+class PluginTimer(object):
+    """Add up the time spent replacing tags, around ``replace_build_tags``."""
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self._replace_build_tags = plugin.replace_build_tags
+
+    def __call__(self, batches, **kwargs):
+        start = time.time()
+        try:
+            return self._replace_build_tags(batches, **kwargs)
+        finally:
+            self.elapsed += time.time() - start
+
+
+def parse_setting(value):
+    name, _, value = value.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def build(settings, server, timer):
+    """Run a build, and return its statistics."""
+    server.reset_stats()
+    timer.elapsed = 0.0
+    start = time.time()
+    Pelican(read_settings(None, override=settings)).run()
+    return {
+        'wall': time.time() - start,
+        'plugin': timer.elapsed,
+        'requests': server.requests,
+        'errors': server.errors,
+        'kbytes': server.bytes_sent / 1024.0,
+        'calls': dict(server.calls),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=10,
+                        help='photo tags per document')
+    parser.add_argument('--photos', type=int, default=500,
+                        help='different photos in the whole site')
+    parser.add_argument('--groups', type=int, default=0,
+                        help='photosets shown in a grid')
+    parser.add_argument('--group-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the fake server waits before answering')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of requests failing with a 503')
+    parser.add_argument('--invalidate', type=float, default=0.1,
+                        help='share of photos changed before the last build')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=JSON',
+                        help='override a setting, like FLICKR_TAG_API_FORMAT="json"')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help="don't delete the site, output and cache")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix='flickrtag-bench-')
+    content = os.path.join(workdir, 'content')
+    groups = sitegen.generate_site(content, args.documents, args.tags,
+                                   args.photos, args.groups, args.group_size)
+
+    server = fakeflickr.FakeFlickr(latency=args.latency,
+                                   error_rate=args.error_rate).start()
+    server.groups.update(groups)
+    flickr.HOST = server.url
+
+    settings = {
+        'PATH': content,
+        'OUTPUT_PATH': os.path.join(workdir, 'output'),
+        'PLUGINS': ['pelican_flickrtag'],
+        'SITEURL': '',
+        'CACHE_CONTENT': False,
+        'LOAD_CONTENT_CACHE': False,
+        'FLICKR_API_KEY': 'bench-key',
+        'FLICKR_API_SECRET': 'bench-secret',
+        'FLICKR_API_TOKEN': 'bench-token',
+        'FLICKR_TAG_CACHE_LOCATION': os.path.join(workdir, 'cache'),
+        'FLICKR_TAG_CACHE_REFRESH': True,
+    }
+    settings.update(parse_setting(value) for value in args.set)
+
+    timer = PluginTimer()
+    plugin.replace_build_tags = timer
+    results = []
+    try:
+        results.append(('cold', build(settings, server, timer)))
+        results.append(('warm', build(settings, server, timer)))
+
+        photo_ids = sitegen.photo_ids(args.photos)
+        server.updated = random.Random(1).sample(
+            photo_ids, int(len(photo_ids) * args.invalidate))
+        results.append(('partial', build(settings, server, timer)))
+    finally:
+        plugin.replace_build_tags = timer._replace_build_tags
+        server.stop()
+        if args.keep:
+            print('Kept %s' % workdir)
+        else:
+            shutil.rmtree(workdir)
+
+    print('%d documents, %d tags each, %d photos, %.0f ms latency, '
+          '%.0f%% errors' % (args.documents, args.tags, args.photos,
+                             args.latency * 1000, args.error_rate * 100))
+    print('%-8s %10s %10s %9s %7s %9s' % ('build', 'wall (s)', 'plugin (s)',
+                                          'requests', 'errors', 'KiB'))
+    for name, result in results:
+        print('%-8s %10.3f %10.3f %9d %7d %9.1f' % (
+            name, result['wall'], result['plugin'], result['requests'],
+            result['errors'], result['kbytes']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'builds': dict(results)}, f,
+                      indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the memory and attribute access time of the slot based
+``flickr.Photo`` with a Photo kept in a per-instance ``__dict__`` and read
+through ``__getattr__``, as it was before.
+
+    $ python benchmarks/bench_objects.py
+"""
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pelican_flickrtag import flickr  # noqa: E402
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+FIELDS = ['id', 'secret', 'server', 'farm', 'isfavorite', 'license', 'rotation',
+          'owner', 'dateposted', 'datetaken', 'takengranularity', 'title',
+          'description', 'ispublic', 'isfriend', 'isfamily', 'cancomment',
+          'canaddmeta', 'comments', 'tags', 'permcomment', 'permaddmeta', 'url']
+
+
+class DictPhoto(object):
+    """The fields of a Photo in its ``__dict__``, found by ``__getattr__``
+    scanning the list of read-only fields."""
+
+    __readonly = FIELDS
+
+    def __init__(self, id, owner=None, title=None, ispublic=None,
+                 isfriend=None, isfamily=None, secret=None, server=None,
+                 farm=None, url=None, sizes=None):
+        self.__loaded = False
+        self.__dateuploaded = None
+        self.__sizes = sizes
+        for name in FIELDS:
+            object.__setattr__(self, '_DictPhoto__' + name, None)
+        self.__id = id
+        self.__owner = owner
+        self.__title = title
+        self.__ispublic = ispublic
+        self.__isfriend = isfriend
+        self.__isfamily = isfamily
+        self.__secret = secret
+        self.__server = server
+        self.__farm = farm
+        self.__url = url
+
+    def __setattr__(self, key, value):
+        if key in self.__class__.__readonly:
+            raise AttributeError("The attribute %s is read-only." % key)
+        super(DictPhoto, self).__setattr__(key, value)
+
+    def __getattr__(self, key):
+        if key in self.__class__.__readonly:
+            name = "_%s__%s" % (self.__class__.__name__, key)
+            if super(DictPhoto, self).__getattribute__(name) is None \
+               and not self.__loaded:
+                raise AssertionError('no loading in a benchmark')
+            return super(DictPhoto, self).__getattribute__(name)
+        return super(DictPhoto, self).__getattribute__(key)
+
+
+def photo_fields(count):
+    """The fields of ``count`` photos, as a list endpoint gives them."""
+    return [dict(id=str(5128831453 + i), owner='12345678@N00',
+                 title='Photo number %d' % i, ispublic='1', isfriend='0',
+                 isfamily='0', secret='a1b2c3d4e5', server='4037', farm='5',
+                 url='https://www.flickr.com/photos/bench/%d/' % i, sizes=[])
+            for i in range(count)]
+
+
+def photos(cls, fields):
+    return [cls(**kwargs) for kwargs in fields]
+
+
+def allocated(cls, fields):
+    """Bytes allocated for photos of ``cls``, not counting the field values."""
+    gc.collect()
+    if tracemalloc is None:
+        return sum(sys.getsizeof(photo) +
+                   (sys.getsizeof(vars(photo)) if hasattr(photo, '__dict__') else 0)
+                   for photo in photos(cls, fields))
+    tracemalloc.start()
+    try:
+        objects = photos(cls, fields)
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del objects
+    return size
+
+
+def read_fields(objects):
+    for photo in objects:
+        photo.id, photo.title, photo.secret, photo.server, photo.farm, photo.url
+
+
+def main():
+    count = 10000
+    fields = photo_fields(count)
+    old_size = allocated(DictPhoto, fields)
+    new_size = allocated(flickr.Photo, fields)
+    print('%d photos' % count)
+    print('%-22s %12s %12s %8s' % ('', '__dict__', 'slots', 'ratio'))
+    print('%-22s %12.0f %12.0f %7.1fx' % ('bytes per photo', old_size / count,
+                                          new_size / count, old_size / float(new_size)))
+
+    old_photos = photos(DictPhoto, fields)
+    new_photos = photos(flickr.Photo, fields)
+    old = min(timeit.repeat(lambda: read_fields(old_photos), number=5, repeat=3)) / 5
+    new = min(timeit.repeat(lambda: read_fields(new_photos), number=5, repeat=3)) / 5
+    reads = count * 6
+    print('%-22s %12.1f %12.1f %7.1fx' % ('ns per field read', old / reads * 1e9,
+                                          new / reads * 1e9, old / new))
+
+    old = min(timeit.repeat(lambda: photos(DictPhoto, fields), number=3, repeat=3)) / 3
+    new = min(timeit.repeat(lambda: photos(flickr.Photo, fields), number=3, repeat=3)) / 3
+    print('%-22s %12.2f %12.2f %7.1fx' % ('us per photo created', old / count * 1e6,
+                                          new / count * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
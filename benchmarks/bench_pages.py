@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time walking a large photo list page by page, with the next page fetched
+in the background, and with several pages fetched at the same time, against
+the local fake Flickr server (see ``fakeflickr.py``).
+
+    $ python benchmarks/bench_pages.py --photos 40000 --latency 0.3
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pelican_flickrtag import flickr  # noqa: E402
+
+import fakeflickr  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--photos', type=int, default=40000)
+    parser.add_argument('--per-page', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.3,
+                        help='seconds the fake server waits before answering')
+    parser.add_argument('--concurrency', type=int, action='append',
+                        help='pages fetched at the same time (repeatable)')
+    args = parser.parse_args()
+
+    server = fakeflickr.FakeFlickr(latency=args.latency).start()
+    server.owned = [str(5128831453 + i) for i in range(args.photos)]
+    flickr.HOST = server.url
+    flickr.responses = None
+
+    print('%d photos, %d per page, %.0f ms latency' % (
+        args.photos, args.per_page, args.latency * 1000))
+    print('%-12s %10s %9s' % ('concurrency', 'time (s)', 'requests'))
+    try:
+        for concurrency in [0] + (args.concurrency or [1, 4, 16]):
+            server.reset_stats()
+            start = time.time()
+            photos = flickr.photos_search_iter(user_id=fakeflickr.OWNER,
+                                               per_page=args.per_page,
+                                               prefetch=concurrency)
+            count = sum(1 for _ in photos)
+            assert count == args.photos
+            print('%-12s %10.2f %9d' % (concurrency or 'sequential',
+                                        time.time() - start, server.requests))
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the streaming response parser (``flickr.parse``) with the DOM based
+path (``flickr.unmarshal(minidom.parseString(...))``) on large synthetic
+``flickr.photos.search`` responses.
+
+    $ python benchmarks/bench_parser.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+from xml.dom import minidom
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pelican_flickrtag import flickr  # noqa: E402
+
+PHOTO = ('<photo id="%(id)d" owner="12345678@N00" secret="a1b2c3d4e5" '
+         'server="4037" farm="5" title="Photo number %(id)d" ispublic="1" '
+         'isfriend="0" isfamily="0" />')
+
+
+def search_response(count):
+    photos = ''.join(PHOTO % {'id': 5128831453 + i} for i in range(count))
+    return ('<?xml version="1.0" encoding="utf-8" ?>\n'
+            '<rsp stat="ok"><photos page="1" pages="1" perpage="%d" total="%d">'
+            '%s</photos></rsp>' % (count, count, photos)).encode('utf-8')
+
+
+def as_dict(value):
+    """Turn a parsed response into plain data so the two parsers can be compared."""
+    if isinstance(value, list):
+        return [as_dict(v) for v in value]
+    if isinstance(value, flickr.Bag):
+        return dict((k, as_dict(v)) for k, v in vars(value).items())
+    return value
+
+
+def dom(body):
+    return flickr.unmarshal(minidom.parseString(body))
+
+
+def main():
+    print('%8s %12s %12s %8s' % ('photos', 'minidom (ms)', 'expat (ms)', 'speedup'))
+    for count in (100, 500, 2000, 10000):
+        body = search_response(count)
+        assert as_dict(dom(body)) == as_dict(flickr.parse(body))
+
+        number = max(1, 2000 // count)
+        old = min(timeit.repeat(lambda: dom(body), number=number, repeat=3)) / number
+        new = min(timeit.repeat(lambda: flickr.parse(body), number=number, repeat=3)) / number
+        print('%8d %12.2f %12.2f %7.1fx' % (count, old * 1000, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    main()
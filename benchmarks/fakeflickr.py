@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the Flickr REST API, for benchmarks.
+
+Implements the methods used by ``pelican_flickrtag``, answering with made-up
+but consistent photos for any numeric photo id, in XML or JSON, gzip
+compressed when asked. Every response can be delayed by ``latency`` seconds,
+and a ``error_rate`` fraction of them fail with a 503.
+
+    server = FakeFlickr(latency=0.05).start()
+    flickr.HOST = server.url
+    ...
+    server.stop()
+"""
+from __future__ import print_function
+
+import gzip
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import quoteattr, escape
+
+OWNER = '12345678@N00'
+PATH_ALIAS = 'bench'
+
+# label, url suffix, url_* extra, width, height
+SIZES = (
+    ('Square', 's', 'sq', 75, 75),
+    ('Large Square', 'q', 'q', 150, 150),
+    ('Thumbnail', 't', 't', 100, 67),
+    ('Small', 'm', 's', 240, 160),
+    ('Small 320', 'n', 'n', 320, 213),
+    ('Medium', '', 'm', 500, 333),
+    ('Medium 640', 'z', 'z', 640, 427),
+    ('Medium 800', 'c', 'c', 800, 534),
+    ('Large', 'b', 'l', 1024, 683),
+    ('Large 1600', 'h', 'h', 1600, 1067),
+    ('Large 2048', 'k', 'k', 2048, 1365),
+    ('Original', 'o', 'o', 4000, 2667),
+)
+
+# Sizes larger than Large have their own secret
+OWN_SECRET_SUFFIXES = ('h', 'k', 'o')
+
+
+def secret(photo_id, salt=''):
+    return hashlib.sha1(('%s%s' % (photo_id, salt)).encode('utf-8')).hexdigest()[:10]
+
+
+def photo_server(photo_id):
+    return str(1000 + int(photo_id) % 9000)
+
+
+def photo_farm(photo_id):
+    return str(1 + int(photo_id) % 9)
+
+
+def image_url(photo_id, suffix):
+    return 'https://live.staticflickr.com/%s/%s_%s%s.jpg' % (
+        photo_server(photo_id), photo_id,
+        secret(photo_id, suffix if suffix in OWN_SECRET_SUFFIXES else ''),
+        '_' + suffix if suffix else '')
+
+
+def page_url(photo_id):
+    return 'https://www.flickr.com/photos/%s/%s/' % (PATH_ALIAS, photo_id)
+
+
+def to_xml(name, node):
+    """Serialize a response node the way Flickr does in XML.
+
+    Strings are attributes, dicts and lists of dicts child elements, and
+    ``_content`` the text of an element.
+    """
+    if isinstance(node, list):
+        return ''.join(to_xml(name, item) for item in node)
+    attrs = ''.join(' %s=%s' % (key, quoteattr(str(value)))
+                    for key, value in sorted(node.items())
+                    if not isinstance(value, (dict, list)) and key != '_content')
+    children = ''.join(to_xml(key, value) for key, value in sorted(node.items())
+                       if isinstance(value, (dict, list)))
+    text = escape(str(node.get('_content', '')))
+    return '<%s%s>%s%s</%s>' % (name, attrs, text, children, name)
+
+
+class FakeFlickr(object):
+    """The fake API and the HTTP server answering it.
+
+    ``missing`` holds photo ids answered with "Photo not found",
+    ``updated`` the photo ids returned by flickr.photos.recentlyUpdated,
+    ``owned`` the photo ids listed for the owner by flickr.photos.search and
+    flickr.people.getPublicPhotos, newest (highest) first, and ``groups`` the photo ids of each
+    photoset and gallery id.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.missing = set()
+        self.updated = []
+        self.owned = []
+        self.groups = {}
+        self.lock = threading.Lock()
+        self.reset_stats()
+        self._server = None
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = {}
+            self.errors = 0
+            self.bytes_sent = 0
+
+    @property
+    def requests(self):
+        return sum(self.calls.values())
+
+    # -- responses -----------------------------------------------------------
+
+    def photo(self, photo_id, extras=()):
+        """The <photo> of a photo in a list, with the url_* extras asked for."""
+        photo = {
+            'id': str(photo_id), 'owner': OWNER, 'secret': secret(photo_id),
+            'server': photo_server(photo_id), 'farm': photo_farm(photo_id),
+            'title': 'Photo %s' % photo_id, 'ispublic': '1', 'isfriend': '0',
+            'isfamily': '0',
+        }
+        if 'path_alias' in extras:
+            photo['pathalias'] = PATH_ALIAS
+        for label, suffix, extra, width, height in SIZES:
+            if 'url_' + extra in extras:
+                photo['url_' + extra] = image_url(photo_id, suffix)
+                photo['width_' + extra] = str(width)
+                photo['height_' + extra] = str(height)
+        return photo
+
+    def photos_page(self, photo_ids, params):
+        per_page = int(params.get('per_page') or 100)
+        page = int(params.get('page') or 1)
+        extras = (params.get('extras') or '').split(',')
+        pages = max(1, (len(photo_ids) + per_page - 1) // per_page)
+        ids = photo_ids[(page - 1) * per_page:page * per_page]
+        return {
+            'page': str(page), 'pages': str(pages), 'perpage': str(per_page),
+            'total': str(len(photo_ids)),
+            'photo': [self.photo(id, extras) for id in ids],
+        }
+
+    def getInfo(self, params):
+        photo_id = params['photo_id']
+        return {'photo': {
+            'id': photo_id, 'secret': secret(photo_id),
+            'server': photo_server(photo_id), 'farm': photo_farm(photo_id),
+            'dateuploaded': '1300000000', 'isfavorite': '0', 'license': '0',
+            'rotation': '0',
+            'owner': {'nsid': OWNER, 'username': 'bench', 'realname': 'Bench',
+                      'location': ''},
+            'title': {'_content': 'Photo %s' % photo_id},
+            'description': {'_content': 'A photo to benchmark with'},
+            'visibility': {'ispublic': '1', 'isfriend': '0', 'isfamily': '0'},
+            'dates': {'posted': '1300000000', 'taken': '2011-03-13 12:00:00',
+                      'takengranularity': '0', 'lastupdate': '1300000000'},
+            'editability': {'cancomment': '0', 'canaddmeta': '0'},
+            'comments': {'_content': '0'},
+            'tags': {},
+            'urls': {'url': [{'type': 'photopage',
+                              '_content': page_url(photo_id)}]},
+        }}
+
+    def getSizes(self, params):
+        photo_id = params['photo_id']
+        return {'sizes': {
+            'canblog': '0', 'canprint': '0', 'candownload': '1',
+            'size': [{'label': label, 'width': str(width),
+                      'height': str(height), 'media': 'photo',
+                      'source': image_url(photo_id, suffix),
+                      'url': '%ssizes/%s/' % (page_url(photo_id), extra)}
+                     for label, suffix, extra, width, height in SIZES],
+        }}
+
+    def photoset(self, params):
+        photoset_id = params['photoset_id']
+        photoset = self.photos_page(self.groups.get(photoset_id, []), params)
+        photoset.update(id=photoset_id, owner=OWNER, title='Set %s' % photoset_id)
+        for photo in photoset['photo']:
+            del photo['owner']
+        return {'photoset': photoset}
+
+    def gallery(self, params):
+        photos = self.photos_page(self.groups.get(params['gallery_id'], []), params)
+        for photo in photos['photo']:
+            photo['has_comment'] = '0'
+        return {'photos': photos}
+
+    def owner_photos(self, params):
+        return {'photos': self.photos_page(
+            sorted(self.owned, key=int, reverse=True), params)}
+
+    def recently_updated(self, params):
+        return {'photos': self.photos_page(self.updated, params)}
+
+    METHODS = {
+        'flickr.photos.getInfo': getInfo,
+        'flickr.photos.getSizes': getSizes,
+        'flickr.photosets.getPhotos': photoset,
+        'flickr.galleries.getPhotos': gallery,
+        'flickr.photos.search': owner_photos,
+        'flickr.people.getPublicPhotos': owner_photos,
+        'flickr.photos.recentlyUpdated': recently_updated,
+    }
+
+    def respond(self, params):
+        """Return the status and body of the response to an API request."""
+        method = params.get('method')
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            return 503, b'Service Unavailable'
+
+        if method not in self.METHODS:
+            data = {'stat': 'fail', 'code': '112',
+                    'message': 'Method "%s" not found' % method}
+        elif params.get('photo_id') in self.missing:
+            data = {'stat': 'fail', 'code': '1', 'message': 'Photo not found'}
+        else:
+            data = dict(self.METHODS[method](self, params), stat='ok')
+
+        if params.get('format') == 'json':
+            return 200, json.dumps(data).encode('utf-8')
+        if data['stat'] == 'fail':
+            data = {'stat': 'fail', 'err': {'code': data['code'],
+                                            'msg': data['message']}}
+        return 200, ('<?xml version="1.0" encoding="utf-8" ?>\n%s'
+                     % to_xml('rsp', data)).encode('utf-8')
+
+    # -- server --------------------------------------------------------------
+
+    def start(self):
+        """Serve on a free local port, in a background thread."""
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.fake = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self._server.server_address
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _params(self, query):
+        return dict((key, values[0]) for key, values in parse_qs(query).items())
+
+    def _reply(self, params):
+        fake = self.server.fake
+        status, body = fake.respond(params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+                f.write(body)
+            body = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with fake.lock:
+            fake.bytes_sent += len(body)
+
+    def do_GET(self):
+        self._reply(self._params(urlsplit(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        params = self._params(urlsplit(self.path).query)
+        params.update(self._params(self.rfile.read(length).decode('utf-8')))
+        self._reply(params)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Generate synthetic Pelican sites full of Flickr tags, for benchmarks.
+
+    $ python benchmarks/sitegen.py /tmp/site --documents 100 --tags 10
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import os
+import random
+
+FIRST_PHOTO_ID = 5128831453
+FIRST_GROUP_ID = 72157624428925278
+
+# reStructuredText, which Pelican reads without optional dependencies
+ARTICLE = u"""Article {number}
+{rule}
+
+:date: 2013-01-{day:02d} 10:00
+:category: Benchmarks
+:slug: article-{number}
+
+Some text before the photos of article {number}.
+
+{tags}
+
+And some after them.
+"""
+
+
+def photo_ids(count):
+    """The ids of the photos a site with ``count`` photos shows."""
+    return [str(FIRST_PHOTO_ID + i) for i in range(count)]
+
+
+def generate_site(path, documents=100, tags=10, photos=500, groups=0,
+                  group_size=50, title_every=3, seed=0):
+    """Write ``documents`` articles with ``tags`` photo tags each to
+    ``path``.
+
+    The tags pick from ``photos`` different photos, every ``title_every``-th
+    one with its own title. Every article also shows one of ``groups``
+    photosets, each of ``group_size`` photos. Returns a dict mapping the
+    photoset ids to their photo ids, for the fake server.
+    """
+    rand = random.Random(seed)
+    ids = photo_ids(photos)
+    group_ids = dict(
+        (str(FIRST_GROUP_ID + i), rand.sample(ids, min(group_size, len(ids))))
+        for i in range(groups))
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for number in range(documents):
+        lines = []
+        for tag in range(tags):
+            title = ',title=Photo %d of article %d' % (tag, number) \
+                if title_every and tag % title_every == 0 else ''
+            lines.append(u'[flickr:id=%s%s]' % (rand.choice(ids), title))
+        if group_ids:
+            lines.append(u'[flickrset:id=%s]' % sorted(group_ids)[number % groups])
+        filename = os.path.join(path, 'article-%d.rst' % number)
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            f.write(ARTICLE.format(number=number, day=number % 28 + 1,
+                                   rule=u'#' * len(u'Article %d' % number),
+                                   tags=u'\n\n'.join(lines)))
+    return group_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('path')
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=10,
+                        help='photo tags per document')
+    parser.add_argument('--photos', type=int, default=500,
+                        help='different photos in the whole site')
+    parser.add_argument('--groups', type=int, default=0,
+                        help='photosets shown in a grid')
+    parser.add_argument('--group-size', type=int, default=50)
+    args = parser.parse_args()
+    generate_site(args.path, args.documents, args.tags, args.photos,
+                  args.groups, args.group_size)
+    print('Wrote %d documents to %s' % (args.documents, args.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio Flickr Client
+=====================
+
+Coroutine counterparts of the blocking calls in
+:mod:`pelican_flickrtag.flickr`. They return the same ``Bag``, ``Photo`` and
+size structures, but many of them can be in flight on a single event loop.
+
+Requires aiohttp.
+"""
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+from six.moves.urllib.error import HTTPError, URLError
+
+from pelican_flickrtag import flickr
+
+
+class AsyncFlickr(object):
+    """An asyncio Flickr client.
+
+    ``limit`` is the maximum number of requests in flight at the same time.
+    ``client`` is the ``flickr.FlickrClient`` whose credentials, host,
+    throttle, response cache and stats are used, by default the one in use
+    when the client is made. ``format`` is the response format requested,
+    'xml' or 'json', and defaults to the format of ``client``. Requests are
+    rate limited, limited in concurrency and retried by its throttle and
+    kept in its responses, like the blocking ones, and identical requests in
+    flight at the same time share one, counted in its stats. The connect and read timeouts of ``client`` apply to the
+    session the client makes, unless ``session`` is given.
+    The client must be used from within a running event loop, preferably as
+    an ``async with`` context manager so its session gets closed.
+    """
+
+    def __init__(self, limit=10, session=None, format=None, client=None):
+        self.limit = limit
+        self.client = client if client is not None else flickr.current_client()
+        self.format = format
+        self._session = session
+        self._owns_session = session is None
+        self._semaphore = None
+        # the GETs in flight by url, and how many identical ones shared them
+        self._flights = {}
+        self.coalesced = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+    async def doget(self, method, auth=False, **params):
+        """Coroutine version of ``flickr.FlickrClient.doget``."""
+        # Created lazily so they belong to the loop the client is used on.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(
+                sock_connect=self.client.connect_timeout,
+                sock_read=self.client.read_timeout))
+
+        url = self.client.get_url(method, auth, params, self.format)
+        if flickr.debug:
+            print("_doget", url)
+
+        key = self.client.response_key(method, auth, params, self.format)
+        responses = self.client.responses
+        if key is not None:
+            data = responses.get(key)
+            if data is not None:
+                return data
+
+        if not flickr.is_read_method(method):
+            return await self._fetch(method, url, key, responses)
+        flight = self._flights.get(url)
+        if flight is None:
+            flight = asyncio.ensure_future(self._fetch(method, url, key,
+                                                      responses))
+            self._flights[url] = flight
+            flight.add_done_callback(lambda _: self._flights.pop(url, None))
+        else:
+            self.coalesced += 1
+            stats = self.client.stats
+            if stats is not None:
+                stats.count('coalesced_calls')
+        # A cancelled caller mustn't cancel the others' request
+        return await asyncio.shield(flight)
+
+    async def _fetch(self, method, url, key, responses):
+        throttle = self.client.throttle
+        limit = throttle.limit
+        for attempt in itertools.count():
+            await asyncio.sleep(throttle.wait())
+            started = await self._acquire(limit) if limit is not None else None
+            try:
+                data = await self._get(method, url)
+            except Exception as e:
+                transient = flickr._is_transient(e)
+                if limit is not None:
+                    limit.release(started, ok=not transient)
+                delay = throttle.retry_delay(attempt, e) if transient else None
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+            else:
+                if limit is not None:
+                    limit.release(started)
+                if key is not None:
+                    responses.set(key, method, data)
+                return data
+
+    @staticmethod
+    async def _acquire(limit):
+        """Wait for the ``transport.AdaptiveLimit`` of the client, shared with
+        its blocking calls, without blocking the loop."""
+        delay = 0.001
+        while True:
+            started = limit.try_acquire()
+            if started is not None:
+                return started
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    async def _get(self, method, url):
+        start = time.time()
+        size = 0
+        ok = False
+        try:
+            async with self._semaphore:
+                start = time.time()
+                async with self._session.get(url) as response:
+                    body = await response.read()
+            # The body was decompressed, the header has what was received
+            size = int(response.headers.get('Content-Length', len(body)))
+            if response.status >= 400:
+                raise HTTPError(url, response.status, response.reason,
+                                response.headers, None)
+            result = flickr._get_data(self.client.parse_response(body,
+                                                                self.format))
+            ok = True
+            return result
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise URLError(e)
+        finally:
+            stats = self.client.stats
+            if stats is not None:
+                stats.record_call(method, time.time() - start, size, ok)
+
+    async def photos_getInfo(self, photo_id):
+        """Returns a fully loaded Photo object."""
+        data = await self.doget('flickr.photos.getInfo', photo_id=photo_id)
+        photo = flickr.Photo(photo_id)
+        photo._set_properties(data.rsp.photo)
+        return photo
+
+    async def photos_getSizes(self, photo_id):
+        """Returns a list of dicts with the size data of a photo."""
+        data = await self.doget('flickr.photos.getSizes', photo_id=photo_id)
+        return flickr._parse_sizes(data.rsp.sizes)
+
+    async def photosets_getPhotos(self, photoset_id, extras='', per_page='',
+                                  page=''):
+        """Returns list of Photos in a photoset."""
+        data = await self.doget('flickr.photosets.getPhotos',
+                                photoset_id=photoset_id, extras=extras,
+                                per_page=per_page, page=page)
+        return flickr._parse_photoset_photos(data.rsp.photoset)
+
+    async def galleries_getPhotos(self, gallery_id, extras='', per_page='',
+                                  page=''):
+        """Returns list of Photos in a gallery, in gallery order."""
+        data = await self.doget('flickr.galleries.getPhotos',
+                                gallery_id=gallery_id, extras=extras,
+                                per_page=per_page, page=page)
+        return [photo for photo, _ in
+                flickr._parse_gallery_photos(data.rsp.photos)]
+
+    async def photos_search(self, auth=False, **params):
+        """Returns a list of Photo objects. See ``flickr.photos_search``."""
+        data = await self.doget('flickr.photos.search', auth=auth, **params)
+        return flickr._parse_photos(data.rsp.photos)
+
+    async def photos_getRecent(self, extras='', per_page='', page=''):
+        """Returns a list of Photo objects."""
+        data = await self.doget('flickr.photos.getRecent', extras=extras,
+                                per_page=per_page, page=page)
+        return flickr._parse_photos(data.rsp.photos)
+
+    async def people_getPublicPhotos(self, user_id, per_page='', page='',
+                                     extras=''):
+        """Returns list of Photo objects."""
+        data = await self.doget('flickr.people.getPublicPhotos',
+                                user_id=user_id, per_page=per_page, page=page,
+                                extras=extras)
+        return flickr._parse_photos(data.rsp.photos)
+
+    async def favorites_getPublicList(self, user_id, per_page='', page='',
+                                      extras=''):
+        """Returns list of Photo objects."""
+        data = await self.doget('flickr.favorites.getPublicList',
+                                user_id=user_id, per_page=per_page, page=page,
+                                extras=extras)
+        return flickr._parse_photos(data.rsp.photos)
+
+    async def interestingness(self, date='', extras='', per_page='', page=''):
+        """Returns list of Photo objects."""
+        data = await self.doget('flickr.interestingness.getList', date=date,
+                                extras=extras, per_page=per_page, page=page)
+        return flickr._parse_photos(data.rsp.photos)
+
+    async def photos_getInfoAndSizes(self, photo_id, sizes=True, info=True):
+        """Fetch the info and the sizes of a photo concurrently, or only one of
+        them.
+
+        Returns a ``(photo, sizes)`` tuple, with None for what wasn't asked for.
+        """
+        async def nothing():
+            return None
+        return tuple(await asyncio.gather(
+            self.photos_getInfo(photo_id) if info else nothing(),
+            self.photos_getSizes(photo_id) if sizes else nothing()))
+
+
+async def _fetch_photos(photo_ids, sizes, limit, info, client):
+    async with AsyncFlickr(limit=limit, client=client) as client:
+        results = await asyncio.gather(*[
+            client.photos_getInfoAndSizes(photo_id, sizes=sizes, info=info)
+            for photo_id in photo_ids], return_exceptions=True)
+    return dict(zip(photo_ids, results))
+
+
+def fetch_photos(photo_ids, sizes=True, limit=10, info=True, client=None):
+    """Fetch many photos on a private event loop, with the
+    ``flickr.FlickrClient`` ``client`` (by default the one in use).
+
+    Returns a dict mapping each photo id to a ``(photo, sizes)`` tuple, or
+    to the exception fetching it raised.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_fetch_photos(list(photo_ids), sizes,
+                                                     limit, info, client))
+    finally:
+        loop.close()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Photo Cache
+===========
+
+Backends storing the photo information looked up from Flickr, and the photos
+rendered from it, between builds.
+
+``PickleCache`` keeps the whole mapping in a single pickle file, which is
+loaded and rewritten in full. ``SQLiteCache`` reads and upserts single
+entries, and imports an existing pickle file the first time it is opened.
+"""
+import json
+import logging
+import os
+import pickle
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of host parameters in a single statement
+SQLITE_BATCH_SIZE = 500
+
+# PickleCache keeps its metadata and rendered photos under these keys of the
+# pickled mapping, where they can't collide with a photo
+PICKLE_META_KEY = '__meta__'
+PICKLE_FRAGMENTS_KEY = '__fragments__'
+
+
+def photo_id_for_key(key):
+    """The photo id of a cache key.
+
+    Older versions of the plugin keyed entries by ``id-title``.
+    """
+    return key.split('-', 1)[0]
+
+
+class PickleCache(object):
+    """The photo mapping in a single pickle file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._dirty = False
+        try:
+            with open(path, 'rb') as f:
+                self._mapping = pickle.load(f)
+        except (IOError, EOFError, ValueError):
+            self._mapping = {}
+        self._meta = self._mapping.pop(PICKLE_META_KEY, {})
+        self._fragments = self._mapping.pop(PICKLE_FRAGMENTS_KEY, {})
+        # The keys of the rendered photos read or added since opening
+        self._used_fragments = set()
+
+    def get_meta(self, name):
+        return self._meta.get(name)
+
+    def set_meta(self, name, value):
+        self._meta[name] = value
+        self._dirty = True
+
+    def get_many(self, keys):
+        """Return a dict with the cached entries for keys."""
+        return dict((key, self._mapping[key]) for key in keys
+                    if key in self._mapping)
+
+    def update(self, mapping):
+        """Add or replace the entries in mapping."""
+        self._mapping.update(mapping)
+        self._dirty = self._dirty or bool(mapping)
+
+    def get_fragments(self, keys):
+        """Return a dict with the rendered photos cached for keys."""
+        keys = list(keys)
+        self._used_fragments.update(keys)
+        return dict((key, self._fragments[key]) for key in keys
+                    if key in self._fragments)
+
+    def update_fragments(self, fragments):
+        """Add rendered photos by key."""
+        self._used_fragments.update(fragments)
+        self._fragments.update(fragments)
+        self._dirty = self._dirty or bool(fragments)
+
+    def delete_photos(self, photo_ids):
+        """Remove the entries of the photos in photo_ids."""
+        keys = [key for key in self._mapping
+                if photo_id_for_key(key) in photo_ids]
+        for key in keys:
+            del self._mapping[key]
+        self._dirty = self._dirty or bool(keys)
+        return len(keys)
+
+    def commit(self, prune_fragments=False):
+        """Write the cache. With prune_fragments, the rendered photos
+        neither read nor added since it was opened are dropped."""
+        if prune_fragments and self._used_fragments:
+            stale = set(self._fragments) - self._used_fragments
+            for key in stale:
+                del self._fragments[key]
+            self._dirty = self._dirty or bool(stale)
+        if self._dirty:
+            mapping = dict(self._mapping)
+            if self._meta:
+                mapping[PICKLE_META_KEY] = self._meta
+            if self._fragments:
+                mapping[PICKLE_FRAGMENTS_KEY] = self._fragments
+            with open(self.path, 'wb') as f:
+                pickle.dump(mapping, f)
+            self._dirty = False
+
+    def close(self):
+        pass
+
+
+class SQLiteCache(object):
+    """The photo mapping in an SQLite database.
+
+    Entries are stored as JSON, one row each, and indexed by photo id. The
+    database runs in WAL mode so several builds can read it at once. If
+    ``legacy_path`` names a pickle file written by ``PickleCache``, its
+    entries are imported the first time the database is opened.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS photos ('
+                             'key TEXT PRIMARY KEY, '
+                             'photo_id TEXT NOT NULL, '
+                             'data TEXT NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS photos_photo_id '
+                             'ON photos (photo_id)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS fragments ('
+                             'key TEXT PRIMARY KEY, '
+                             'html TEXT NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                             'name TEXT PRIMARY KEY, '
+                             'value TEXT)')
+        # The keys of the rendered photos read or added since opening
+        self._used_fragments = set()
+        if legacy_path is not None:
+            self._migrate(legacy_path)
+
+    def _migrate(self, legacy_path):
+        if self.get_meta('migrated') is not None or not os.path.exists(legacy_path):
+            return
+        legacy = PickleCache(legacy_path)
+        logger.info('[flickrtag]: Importing %d photos from %s'
+                    % (len(legacy._mapping), legacy_path))
+        self.update(legacy._mapping)
+        self.set_meta('migrated', legacy_path)
+        self.commit()
+
+    def get_meta(self, name):
+        row = self._db.execute('SELECT value FROM meta WHERE name = ?',
+                               (name, )).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, name, value):
+        self._db.execute('INSERT OR REPLACE INTO meta (name, value) '
+                         'VALUES (?, ?)', (name, value))
+
+    def _select(self, query, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), SQLITE_BATCH_SIZE):
+            batch = keys[start:start + SQLITE_BATCH_SIZE]
+            for row in self._db.execute(query % ', '.join('?' * len(batch)),
+                                        batch):
+                yield row
+
+    def get_many(self, keys):
+        """Return a dict with the cached entries for keys."""
+        return dict((key, json.loads(data)) for key, data in self._select(
+            'SELECT key, data FROM photos WHERE key IN (%s)', keys))
+
+    def get_fragments(self, keys):
+        """Return a dict with the rendered photos cached for keys."""
+        keys = list(keys)
+        self._used_fragments.update(keys)
+        return dict(self._select(
+            'SELECT key, html FROM fragments WHERE key IN (%s)', keys))
+
+    def update_fragments(self, fragments):
+        """Add rendered photos by key."""
+        self._used_fragments.update(fragments)
+        self._db.executemany(
+            'INSERT OR REPLACE INTO fragments (key, html) VALUES (?, ?)',
+            fragments.items())
+
+    def update(self, mapping):
+        """Add or replace the entries in mapping."""
+        self._db.executemany(
+            'INSERT OR REPLACE INTO photos (key, photo_id, data) '
+            'VALUES (?, ?, ?)',
+            [(key, photo_id_for_key(key), json.dumps(value))
+             for key, value in mapping.items()])
+
+    def delete_photos(self, photo_ids):
+        """Remove the entries of the photos in photo_ids."""
+        photo_ids = list(photo_ids)
+        deleted = 0
+        for start in range(0, len(photo_ids), SQLITE_BATCH_SIZE):
+            batch = photo_ids[start:start + SQLITE_BATCH_SIZE]
+            deleted += self._db.execute(
+                'DELETE FROM photos WHERE photo_id IN (%s)'
+                % ', '.join('?' * len(batch)), batch).rowcount
+        return deleted
+
+    def commit(self, prune_fragments=False):
+        """Commit the changes. With prune_fragments, the rendered photos
+        neither read nor added since the cache was opened are dropped."""
+        if prune_fragments and self._used_fragments:
+            self._db.execute('CREATE TEMP TABLE IF NOT EXISTS used_fragments ('
+                             'key TEXT PRIMARY KEY)')
+            self._db.execute('DELETE FROM used_fragments')
+            self._db.executemany('INSERT INTO used_fragments (key) VALUES (?)',
+                                 [(key, ) for key in self._used_fragments])
+            self._db.execute('DELETE FROM fragments WHERE key NOT IN '
+                             '(SELECT key FROM used_fragments)')
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+
+def open_cache(backend, location):
+    """Open the photo cache for the FLICKR_TAG_CACHE_* settings.
+
+    The SQLite database lives next to the pickle file at ``location``.
+    """
+    if backend == 'pickle':
+        return PickleCache(location)
+    if backend == 'sqlite':
+        return SQLiteCache(location + '.sqlite3', legacy_path=location)
+    raise ValueError('Unknown cache backend %r' % backend)
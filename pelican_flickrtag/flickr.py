@@ -30,16 +30,33 @@ __version__ = "$Rev$"
 __date__ = "$Date$"
 __copyright__ = "Copyright: 2004-2010 James Clarke; Portions: 2007-2008 Joshua Henderson; Portions: 2011 Andrei Vlad Vacariu"
 
+from six.moves import http_client
+from six.moves.urllib.error import HTTPError, URLError
 from six.moves.urllib.parse import urlencode
-from six.moves.urllib.request import urlopen
 from xml.dom import minidom
+from xml.parsers import expat
+from functools import partial
+from operator import attrgetter
+import collections
 import hashlib
+import json
 import os
+import socket
+import threading
+import time
+import zlib
+
+import six
+
+from pelican_flickrtag.responses import ResponseCache, is_read_method
+from pelican_flickrtag.transport import ConnectionPool, SingleFlight, Throttle
 
 HOST = 'https://flickr.com'
 API = '/services/rest'
 
-# set these here or using flickr.API_KEY in your application
+# set these here or using flickr.API_KEY in your application.
+# Along with the settings below they configure default_client. Make a
+# FlickrClient to use other credentials or hosts alongside it.
 API_TOKEN = None
 API_KEY = ''
 API_SECRET = ''
@@ -48,6 +65,46 @@ password = None
 AUTH = False
 debug = False
 
+# the response format requested from the REST endpoint, 'xml' or 'json'.
+# Both are turned into the same data structure.
+FORMAT = 'xml'
+
+# timeouts (in seconds) for connecting to and reading from HOST
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+# keep-alive connections shared by _doget and _dopost
+pool = ConnectionPool()
+
+# rate limit, concurrency and retries of _doget and _dopost. Replace it with
+# a configured Throttle to limit them, by default only _doget is retried.
+throttle = Throttle()
+
+# the responses of the read methods kept by _doget, unless authenticated.
+# Replace it with a configured ResponseCache (with a disk tier, other TTLs)
+# or set it to None to keep none.
+responses = ResponseCache()
+
+# the pages fetched at the same time by the list functions called with
+# all_pages=True, unless given
+PAGE_CONCURRENCY = 4
+
+# identical GETs of read methods in flight at the same time share a request
+flights = SingleFlight()
+
+# an object told about every request with record_call(method, seconds,
+# bytes, ok), like pelican_flickrtag.stats.BuildStats
+stats = None
+
+# the parameters naming the objects a write changes: the responses to
+# requests with the same ones are no longer kept after it
+WRITE_ID_PARAMS = ('photo_id', 'photoset_id', 'gallery_id', 'group_id')
+
+# HTTP statuses and API error codes ("Service currently unavailable") that
+# are worth a retry
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+TRANSIENT_ERROR_CODES = ('105', )
+
 # The next 2 variables are only important if authentication is used
 
 # this can be set here or using flickr.tokenPath in your application
@@ -59,7 +116,49 @@ tokenPath = ''
 tokenFile = 'token.txt'
 
 
-class FlickrError(Exception): pass
+# the url_* extras of the list endpoints, and the getSizes label of each size
+SIZE_EXTRAS = (('sq', 'Square'), ('q', 'Large Square'), ('t', 'Thumbnail'),
+               ('s', 'Small'), ('n', 'Small 320'), ('m', 'Medium'),
+               ('z', 'Medium 640'), ('c', 'Medium 800'), ('l', 'Large'),
+               ('h', 'Large 1600'), ('k', 'Large 2048'), ('o', 'Original'))
+
+# extras giving every size of a photo and the url of its page
+EXTRAS_SIZES = ['path_alias'] + ['url_' + suffix for suffix, _ in SIZE_EXTRAS]
+
+# extras giving the Photo fields a list endpoint can carry besides those it
+# always has, so reading them doesn't cost a flickr.photos.getInfo each
+EXTRAS_INFO = ['description', 'license', 'date_upload', 'date_taken',
+               'owner_name', 'path_alias']
+
+class FlickrError(Exception):
+    def __init__(self, *args, **kwargs):
+        # the API error code, for errors returned by Flickr
+        self.code = kwargs.pop('code', None)
+        super(FlickrError, self).__init__(*args, **kwargs)
+
+# the errors a request fails with once it isn't retried any more: errors
+# returned by Flickr, transport errors, and responses cut short, corrupted
+# or that can't be parsed
+REQUEST_ERRORS = (FlickrError, EnvironmentError, http_client.HTTPException,
+                  zlib.error, expat.ExpatError, ValueError)
+
+def _lazy_property(cls_name, name):
+    """A read-only property for the field ``name`` of a Flickr object, which
+    loads the object from Flickr the first time an unknown field is read."""
+    slot = '_%s__%s' % (cls_name, name)
+    loaded = '_%s__loaded' % cls_name
+
+    def fget(self):
+        value = getattr(self, slot)
+        if value is None and not getattr(self, loaded):
+            self._load_properties()
+            value = getattr(self, slot)
+        return value
+
+    def fset(self, value):
+        raise AttributeError("The attribute %s is read-only." % name)
+
+    return property(fget, fset)
 
 class Photo(object):
     """Represents a Flickr Photo."""
@@ -70,13 +169,18 @@ class Photo(object):
                   'cancomment', 'canaddmeta', 'comments', 'tags', 'permcomment',
                   'permaddmeta', 'url']
 
+    # Slots instead of a __dict__ per photo: a build keeps thousands of them
+    __slots__ = ['__loaded', '__dateuploaded', '__sizes'] + \
+                ['__' + name for name in __readonly]
+
     #XXX: Hopefully None won't cause problems
     def __init__(self, id, owner=None, dateuploaded=None, \
                  title=None, description=None, ispublic=None, \
                  isfriend=None, isfamily=None, cancomment=None, \
                  canaddmeta=None, comments=None, tags=None, secret=None, \
                  isfavorite=None, server=None, farm=None, license=None, \
-                 rotation=None, url=None):
+                 rotation=None, url=None, sizes=None, dateposted=None, \
+                 datetaken=None, takengranularity=None):
         """Must specify id, rest is optional."""
         self.__loaded = False
         self.__cancomment = cancomment
@@ -98,26 +202,13 @@ class Photo(object):
         self.__tags = tags
         self.__title = title
 
-        self.__dateposted = None
-        self.__datetaken = None
-        self.__takengranularity = None
+        self.__dateposted = dateposted
+        self.__datetaken = datetaken
+        self.__takengranularity = takengranularity
         self.__permcomment = None
         self.__permaddmeta = None
-        self.__url = None
-
-    def __setattr__(self, key, value):
-        if key in self.__class__.__readonly:
-            raise AttributeError("The attribute %s is read-only." % key)
-        else:
-            super(Photo, self).__setattr__(key, value)
-
-    def __getattr__(self, key):
-        if not self.__loaded:
-            self._load_properties()
-        if key in self.__class__.__readonly:
-            return super(Photo, self).__getattribute__("_%s__%s" % (self.__class__.__name__, key))
-        else:
-            return super(Photo, self).__getattribute__(key)
+        self.__url = url
+        self.__sizes = sizes
 
     def _load_properties(self):
         """Loads the properties from Flickr."""
@@ -125,8 +216,11 @@ class Photo(object):
 
         method = 'flickr.photos.getInfo'
         data = _doget(method, photo_id=self.id)
+        self._set_properties(data.rsp.photo)
 
-        photo = data.rsp.photo
+    def _set_properties(self, photo):
+        """Sets the properties from a flickr.photos.getInfo response."""
+        self.__loaded = True
 
         self.__secret = photo.secret
         self.__server = photo.server
@@ -275,22 +369,13 @@ class Photo(object):
     def getSizes(self):
         """
         Get all the available sizes of the current image, and all available
-        data about them.
+        data about them. Photos from a list endpoint called with the url_*
+        extras already know them.
         Returns: A list of dicts with the size data.
         """
-        method = 'flickr.photos.getSizes'
-        data = _doget(method, photo_id=self.id)
-        ret = []
-        # The given props are those that we return and the according types, since
-        # return width and height as string would make "75">"100" be True, which
-        # is just error prone.
-        props = {'url':str,'width':int,'height':int,'label':str,'source':str,'text':str}
-        for psize in data.rsp.sizes.size:
-            d = {}
-            for prop,convert_to_type in props.items():
-                d[prop] = convert_to_type(getattr(psize, prop))
-            ret.append(d)
-        return ret
+        if self.__sizes is not None:
+            return list(self.__sizes)
+        return photos_getSizes(self.id)
 
     #def getExif(self):
         #method = 'flickr.photos.getExif'
@@ -394,9 +479,18 @@ class Photo(object):
             return None
         return data.rsp.galleries.gallery
 
+# Fields that are already known (the id, or those given by a list endpoint)
+# don't need a round trip.
+for _name in Photo._Photo__readonly:
+    setattr(Photo, _name, _lazy_property('Photo', _name))
+del _name
+
 class Photoset(object):
     """A Flickr photoset."""
 
+    __slots__ = ['__id', '__title', '__primary', '__description', '__count',
+                 '__secret', '__server']
+
     def __init__(self, id, title, primary, photos=0, description='', \
                  secret='', server=''):
         self.__id = id
@@ -418,16 +512,17 @@ class Photoset(object):
     def __str__(self):
         return '<Flickr Photoset %s>' % self.id
 
-    def getPhotos(self):
-        """Returns list of Photos."""
-        method = 'flickr.photosets.getPhotos'
-        data = _doget(method, photoset_id=self.id)
-        photos = data.rsp.photoset.photo
-        p = []
-        for photo in photos:
-            p.append(Photo(photo.id, title=photo.title, secret=photo.secret, \
-                           server=photo.server))
-        return p
+    def getPhotos(self, extras='', per_page='', page='', all_pages=False,
+                  concurrency=None):
+        """Returns list of Photos. See photosets_getPhotos."""
+        return photosets_getPhotos(self.id, extras=extras, per_page=per_page,
+                                   page=page, all_pages=all_pages,
+                                   concurrency=concurrency)
+
+    def iterPhotos(self, extras='', per_page=500, prefetch=1):
+        """Iterates over all the Photos. See photosets_getPhotos_iter."""
+        return photosets_getPhotos_iter(self.id, extras=extras,
+                                        per_page=per_page, prefetch=prefetch)
 
     def editPhotos(self, photos, primary=None):
         """Edit the photos in this set.
@@ -520,6 +615,11 @@ class Photoset(object):
 class User(object):
     """A Flickr user."""
 
+    __slots__ = ['__loaded', '__id', '__username', '__isadmin', '__ispro',
+                 '__realname', '__location', '__photos_firstdate',
+                 '__photos_firstdatetaken', '__photos_count', '__icon_server',
+                 '__icon_url']
+
     def __init__(self, id, username=None, isadmin=None, ispro=None, \
                  realname=None, location=None, firstdate=None, count=None):
         """id required, rest optional."""
@@ -531,31 +631,23 @@ class User(object):
         self.__realname = realname
         self.__location = location
         self.__photos_firstdate = firstdate
+        self.__photos_firstdatetaken = None
         self.__photos_count = count
+        self.__icon_server = None
+        self.__icon_url = None
 
     #property fu
-    id = property(lambda self: self._general_getattr('id'))
-    username = property(lambda self: self._general_getattr('username'))
-    isadmin = property(lambda self: self._general_getattr('isadmin'))
-    ispro = property(lambda self: self._general_getattr('ispro'))
-    realname = property(lambda self: self._general_getattr('realname'))
-    location = property(lambda self: self._general_getattr('location'))
-    photos_firstdate = property(lambda self: \
-                                self._general_getattr('photos_firstdate'))
-    photos_firstdatetaken = property(lambda self: \
-                                     self._general_getattr\
-                                     ('photos_firstdatetaken'))
-    photos_count = property(lambda self: \
-                            self._general_getattr('photos_count'))
-    icon_server= property(lambda self: self._general_getattr('icon_server'))
-    icon_url= property(lambda self: self._general_getattr('icon_url'))
-
-    def _general_getattr(self, var):
-        """Generic get attribute function."""
-        if getattr(self, "_%s__%s" % (self.__class__.__name__, var)) is None \
-           and not self.__loaded:
-            self._load_properties()
-        return getattr(self, "_%s__%s" % (self.__class__.__name__, var))
+    id = _lazy_property('User', 'id')
+    username = _lazy_property('User', 'username')
+    isadmin = _lazy_property('User', 'isadmin')
+    ispro = _lazy_property('User', 'ispro')
+    realname = _lazy_property('User', 'realname')
+    location = _lazy_property('User', 'location')
+    photos_firstdate = _lazy_property('User', 'photos_firstdate')
+    photos_firstdatetaken = _lazy_property('User', 'photos_firstdatetaken')
+    photos_count = _lazy_property('User', 'photos_count')
+    icon_server = _lazy_property('User', 'icon_server')
+    icon_url = _lazy_property('User', 'icon_url')
 
     def _load_properties(self):
         """Load User properties from Flickr."""
@@ -615,13 +707,13 @@ class User(object):
                                      photos=photoset.photos))
         return sets
 
-    def getPublicFavorites(self, per_page='', page=''):
+    def getPublicFavorites(self, per_page='', page='', extras=''):
         return favorites_getPublicList(user_id=self.id, per_page=per_page, \
-                                       page=page)
+                                       page=page, extras=extras)
 
-    def getFavorites(self, per_page='', page=''):
+    def getFavorites(self, per_page='', page='', extras=''):
         return favorites_getList(user_id=self.id, per_page=per_page, \
-                                 page=page)
+                                 page=page, extras=extras)
 
     def getGalleries(self, per_page='', page=''):
         return galleries_getList(user_id=self.id, per_page=per_page, \
@@ -629,11 +721,16 @@ class User(object):
 
 class Group(object):
     """Flickr Group Pool"""
+
+    __slots__ = ['__loaded', '__id', '__name', '__description', '__members',
+                 '__online', '__privacy', '__chatid', '__chatcount', '__url']
+
     def __init__(self, id, name=None, members=None, online=None,\
                  privacy=None, chatid=None, chatcount=None):
         self.__loaded = False
         self.__id = id
         self.__name = name
+        self.__description = None
 
         self.__members = members
         self.__online = online
@@ -642,20 +739,13 @@ class Group(object):
         self.__chatcount = chatcount
         self.__url = None
 
-    id = property(lambda self: self._general_getattr('id'))
-    name = property(lambda self: self._general_getattr('name'))
-    members = property(lambda self: self._general_getattr('members'))
-    online = property(lambda self: self._general_getattr('online'))
-    privacy = property(lambda self: self._general_getattr('privacy'))
-    chatid = property(lambda self: self._general_getattr('chatid'))
-    chatcount = property(lambda self: self._general_getattr('chatcount'))
-
-    def _general_getattr(self, var):
-        """Generic get attribute function."""
-        if getattr(self, "_%s__%s" % (self.__class__.__name__, var)) is None \
-           and not self.__loaded:
-            self._load_properties()
-        return getattr(self, "_%s__%s" % (self.__class__.__name__, var))
+    id = _lazy_property('Group', 'id')
+    name = _lazy_property('Group', 'name')
+    members = _lazy_property('Group', 'members')
+    online = _lazy_property('Group', 'online')
+    privacy = _lazy_property('Group', 'privacy')
+    chatid = _lazy_property('Group', 'chatid')
+    chatcount = _lazy_property('Group', 'chatcount')
 
     def _load_properties(self):
         """Loads the properties from Flickr."""
@@ -675,15 +765,12 @@ class Group(object):
     def __str__(self):
         return '<Flickr Group %s>' % self.id
 
-    def getPhotos(self, tags='', per_page='', page=''):
+    def getPhotos(self, tags='', per_page='', page='', extras=''):
         """Get a list of photo objects for this group"""
         method = 'flickr.groups.pools.getPhotos'
         data = _doget(method, group_id=self.id, tags=tags,\
-                      per_page=per_page, page=page)
-        photos = []
-        for photo in data.rsp.photos.photo:
-            photos.append(_parse_photo(photo))
-        return photos
+                      per_page=per_page, page=page, extras=extras)
+        return _parse_photos(data.rsp.photos)
 
     def add(self, photo):
         """Adds a Photo to the group"""
@@ -698,6 +785,8 @@ class Group(object):
         return True
 
 class Tag(object):
+    __slots__ = ['id', 'author', 'raw', 'text']
+
     def __init__(self, id, author, raw, text):
         self.id = id
         self.author = author
@@ -717,6 +806,12 @@ class Gallery(object):
     # if the user wants to change them when creating
     # an instance.
 
+    __slots__ = ['__loaded', '__url', '__id', '__owner', '__title',
+                 '__description', '__date_create', '__date_update',
+                 '__count_photos', '__count_videos', '__primary_photo_id',
+                 '__primary_photo_server', '__primary_photo_farm',
+                 '__primary_photo_secret']
+
     def __init__(self, id, owner=None, title=None, description=None, \
                  date_create=None, date_update=None, count_photos=None, \
                  count_videos=None, primary_photo_id=None, \
@@ -740,26 +835,19 @@ class Gallery(object):
         self.__primary_photo_farm = primary_photo_farm
         self.__primary_photo_secret = primary_photo_secret
 
-    id = property(lambda self: self._general_getattr('id'))
-    url = property(lambda self: self._general_getattr('url'))
-    owner = property(lambda self: self._general_getattr('owner'))
-    title = property(lambda self: self._general_getattr('title'))
-    description = property(lambda self: self._general_getattr('description'))
-    date_create = property(lambda self: self._general_getattr('date_create'))
-    date_update = property(lambda self: self._general_getattr('date_update'))
-    count_photos = property(lambda self: self._general_getattr('count_photos'))
-    count_videos = property(lambda self: self._general_getattr('count_videos'))
-    primary_photo_id = property(lambda self: self._general_getattr('primary_photo_id'))
-    primary_photo_server = property(lambda self: self._general_getattr('primary_photo_server'))
-    primary_photo_farm = property(lambda self: self._general_getattr('primary_photo_farm'))
-    primary_photo_secret = property(lambda self: self._general_getattr('primary_photo_secret'))
-
-    def _general_getattr(self, var):
-        """Generic get attribute function."""
-        if getattr(self, "_%s__%s" % (self.__class__.__name__, var)) is None \
-           and not self.__loaded:
-            self._load_properties()
-        return getattr(self, "_%s__%s" % (self.__class__.__name__, var))
+    id = _lazy_property('Gallery', 'id')
+    url = _lazy_property('Gallery', 'url')
+    owner = _lazy_property('Gallery', 'owner')
+    title = _lazy_property('Gallery', 'title')
+    description = _lazy_property('Gallery', 'description')
+    date_create = _lazy_property('Gallery', 'date_create')
+    date_update = _lazy_property('Gallery', 'date_update')
+    count_photos = _lazy_property('Gallery', 'count_photos')
+    count_videos = _lazy_property('Gallery', 'count_videos')
+    primary_photo_id = _lazy_property('Gallery', 'primary_photo_id')
+    primary_photo_server = _lazy_property('Gallery', 'primary_photo_server')
+    primary_photo_farm = _lazy_property('Gallery', 'primary_photo_farm')
+    primary_photo_secret = _lazy_property('Gallery', 'primary_photo_secret')
 
     def _load_properties(self):
         """Loads the properties from Flickr."""
@@ -827,31 +915,26 @@ class Gallery(object):
                 primary_photo_id=primary_photo.id, photo_ids=photo_ids)
         return True
 
-    def getPhotos(self, per_page='', page='', **extras):
-        """Return the list of photos for a gallery.
+    def getPhotos(self, per_page='', page='', extras=''):
+        """Return the photos of a gallery, as a dict with each Photo as key
+        and its comment (or '') as value.
 
-        *extras (optional): A comma-delimited list of extra information
-        to fetch for each returned record. Currently supported fields are:
-        description, license, date_upload, date_taken, owner_name,
-        icon_server, original_format, last_update, geo, tags, machine_tags,
-        o_dims, views, media, path_alias, url_sq, url_t, url_s, url_m, url_o
+        extras (optional): A comma-delimited list (or a list) of extra
+        information to fetch for each returned record. Currently supported
+        fields are: description, license, date_upload, date_taken,
+        owner_name, icon_server, original_format, last_update, geo, tags,
+        machine_tags, o_dims, views, media, path_alias and the url_* sizes
         """
         method = 'flickr.galleries.getPhotos'
-
-        extras = ','.join('%s=%s' % (i, v) for i, v in dict(extras).items())
-
         data = _doget(method, gallery_id=self.id, per_page=per_page, \
                       page=page, extras=extras)
-        photos = {} # dict with photo instance as key and comment as value.
-                    # if there's no comment, '' will be assigned.
-        for photo in data.rsp.photos.photo:
-            if photo.has_comment == '1':
-                photos[_parse_photo(photo)] = photo.comment.text
-            elif photo.has_comment == '0':
-                photos[_parse_photo(photo)] = ''
-            else: # Shouldn't EVER get here
-                raise FlickrError
-        return photos
+        return dict(_parse_gallery_photos(data.rsp.photos))
+
+    def iterPhotos(self, extras='', per_page=500, prefetch=1):
+        """Iterates over all the Photos, in gallery order. See
+        galleries_getPhotos_iter."""
+        return galleries_getPhotos_iter(self.id, extras=extras,
+                                        per_page=per_page, prefetch=prefetch)
 
 #Flickr API methods
 #see api docs http://www.flickr.com/services/api/
@@ -862,36 +945,40 @@ def photos_search(user_id='', auth=False,  tags='', tag_mode='', text='',\
                   min_upload_date='', max_upload_date='',\
                   min_taken_date='', max_taken_date='', \
                   license='', per_page='', page='', sort='',\
-                  safe_search='', content_type='' ):
+                  safe_search='', content_type='', extras='', \
+                  all_pages=False, concurrency=None):
     """Returns a list of Photo objects.
 
     If auth=True then will auth the user.  Can see private etc
+    extras is a comma-delimited list (or a list) of extra information to
+    fetch for each photo, e.g. EXTRAS_SIZES or EXTRAS_INFO.
+    With all_pages=True, returns the photos of every page instead of page,
+    see _all_pages.
     """
     method = 'flickr.photos.search'
 
-    data = _doget(method, auth=auth, user_id=user_id, tags=tags, text=text,\
+    params = dict(user_id=user_id, tags=tags, text=text,\
                   min_upload_date=min_upload_date,\
                   max_upload_date=max_upload_date, \
                   min_taken_date=min_taken_date, \
                   max_taken_date=max_taken_date, \
-                  license=license, per_page=per_page,\
-                  page=page, sort=sort,  safe_search=safe_search, \
+                  license=license, sort=sort, safe_search=safe_search, \
                   content_type=content_type, \
-                  tag_mode=tag_mode)
-    photos = []
-    if data.rsp.photos.__dict__.has_key('photo'):
-        if isinstance(data.rsp.photos.photo, list):
-            for photo in data.rsp.photos.photo:
-                photos.append(_parse_photo(photo))
-        else:
-            photos = [_parse_photo(data.rsp.photos.photo)]
-    return photos
+                  tag_mode=tag_mode, extras=extras)
+    if all_pages:
+        return _all_pages(photos_search_iter, per_page, concurrency,
+                          auth=auth, **params)
+    data = _doget(method, auth=auth, per_page=per_page, page=page, **params)
+    return _parse_photos(data.rsp.photos)
 
 def photos_search_pages(user_id='', auth=False,  tags='', tag_mode='', text='',\
                   min_upload_date='', max_upload_date='',\
                   min_taken_date='', max_taken_date='', \
                   license='', per_page='', page='', sort=''):
     """Returns the number of pages for the previous function (photos_search())
+
+    To go through the pages, photos_search_iter knows them from its first
+    page instead.
     """
 
     method = 'flickr.photos.search'
@@ -906,19 +993,59 @@ def photos_search_pages(user_id='', auth=False,  tags='', tag_mode='', text='',\
 
     return data.rsp.photos.pages
 
+def photos_getInfo(photo_id):
+    """Returns a fully loaded Photo object. (flickr.photos.getInfo)"""
+    method = 'flickr.photos.getInfo'
+    data = _doget(method, photo_id=photo_id)
+    photo = Photo(photo_id)
+    photo._set_properties(data.rsp.photo)
+    return photo
+
+def photos_getSizes(photo_id):
+    """
+    Get all the available sizes of a photo, and all available data about
+    them. (flickr.photos.getSizes)
+    Returns: A list of dicts with the size data.
+    """
+    method = 'flickr.photos.getSizes'
+    data = _doget(method, photo_id=photo_id)
+    return _parse_sizes(data.rsp.sizes)
+
+def photosets_getPhotos(photoset_id, extras='', per_page='', page='',
+                        all_pages=False, concurrency=None):
+    """Returns the list of Photo objects in a photoset, one page of up to
+    per_page (at most 500) with page, or all of them with all_pages=True
+    (see _all_pages). extras is a comma-delimited list (or a list) of extra
+    information to fetch for each photo."""
+    if all_pages:
+        return _all_pages(photosets_getPhotos_iter, per_page, concurrency,
+                          photoset_id, extras=extras)
+    method = 'flickr.photosets.getPhotos'
+    data = _doget(method, photoset_id=photoset_id, extras=extras, \
+                  per_page=per_page, page=page)
+    return _parse_photoset_photos(data.rsp.photoset)
+
+def photos_recentlyUpdated(min_date, extras='', per_page='', page='',
+                           all_pages=False, concurrency=None):
+    """Returns a list of the authenticated user's Photo objects that have
+    been created or modified since min_date (a unix timestamp), of page or
+    of every page with all_pages=True (see _all_pages).
+    http://www.flickr.com/services/api/flickr.photos.recentlyUpdated.html
+    """
+    if all_pages:
+        return _all_pages(photos_recentlyUpdated_iter, per_page, concurrency,
+                          min_date, extras=extras)
+    method = 'flickr.photos.recentlyUpdated'
+    data = _doget(method, auth=True, min_date=min_date, extras=extras,
+                  per_page=per_page, page=page)
+    return _parse_photos(data.rsp.photos)
+
 def photos_get_recent(extras='', per_page='', page=''):
     """http://www.flickr.com/services/api/flickr.photos.getRecent.html
     """
     method = 'flickr.photos.getRecent'
     data = _doget(method, extras=extras, per_page=per_page, page=page)
-    photos = []
-    if data.rsp.photos.__dict__.has_key('photo'):
-        if isinstance(data.rsp.photos.photo, list):
-            for photo in data.rsp.photos.photo:
-                photos.append(_parse_photo(photo))
-        else:
-            photos = [_parse_photo(data.rsp.photos.photo)]
-    return photos
+    return _parse_photos(data.rsp.photos)
 
 
 #XXX: Could be class method in User
@@ -937,45 +1064,37 @@ def people_findByUsername(username):
     return user
 
 #XXX: Should probably be in User as a list User.public
-def people_getPublicPhotos(user_id, per_page='', page=''):
-    """Returns list of Photo objects."""
+def people_getPublicPhotos(user_id, per_page='', page='', extras='',
+                           all_pages=False, concurrency=None):
+    """Returns list of Photo objects, of page or of every page with
+    all_pages=True (see _all_pages)."""
+    if all_pages:
+        return _all_pages(people_getPublicPhotos_iter, per_page, concurrency,
+                          user_id, extras=extras)
     method = 'flickr.people.getPublicPhotos'
-    data = _doget(method, user_id=user_id, per_page=per_page, page=page)
-    photos = []
-    if hasattr(data.rsp.photos, "photo"): # Check if there are photos at all (may be been paging too far).
-        if isinstance(data.rsp.photos.photo, list):
-            for photo in data.rsp.photos.photo:
-                photos.append(_parse_photo(photo))
-        else:
-            photos = [_parse_photo(data.rsp.photos.photo)]
-    return photos
+    data = _doget(method, user_id=user_id, per_page=per_page, page=page,
+                  extras=extras)
+    return _parse_photos(data.rsp.photos)
 
 #XXX: These are also called from User
-def favorites_getList(user_id='', per_page='', page=''):
-    """Returns list of Photo objects."""
+def favorites_getList(user_id='', per_page='', page='', extras='',
+                      all_pages=False, concurrency=None):
+    """Returns list of Photo objects, of page or of every page with
+    all_pages=True (see _all_pages)."""
+    if all_pages:
+        return _all_pages(favorites_getList_iter, per_page, concurrency,
+                          user_id, extras=extras)
     method = 'flickr.favorites.getList'
     data = _doget(method, auth=True, user_id=user_id, per_page=per_page,\
-                  page=page)
-    photos = []
-    if isinstance(data.rsp.photos.photo, list):
-        for photo in data.rsp.photos.photo:
-            photos.append(_parse_photo(photo))
-    else:
-        photos = [_parse_photo(data.rsp.photos.photo)]
-    return photos
+                  page=page, extras=extras)
+    return _parse_photos(data.rsp.photos)
 
-def favorites_getPublicList(user_id, per_page='', page=''):
+def favorites_getPublicList(user_id, per_page='', page='', extras=''):
     """Returns list of Photo objects."""
     method = 'flickr.favorites.getPublicList'
     data = _doget(method, auth=False, user_id=user_id, per_page=per_page,\
-                  page=page)
-    photos = []
-    if isinstance(data.rsp.photos.photo, list):
-        for photo in data.rsp.photos.photo:
-            photos.append(_parse_photo(photo))
-    else:
-        photos = [_parse_photo(data.rsp.photos.photo)]
-    return photos
+                  page=page, extras=extras)
+    return _parse_photos(data.rsp.photos)
 
 def favorites_add(photo_id):
     """Add a photo to the user's favorites."""
@@ -1068,16 +1187,13 @@ def contacts_getPublicList(user_id):
 #       user = data.rsp.contacts.contact
 #       return [User(user.nsid, username=user.username)]
 
-def interestingness():
+def interestingness(date='', extras='', per_page='', page=''):
+    """Returns the list of interesting Photo objects of date (YYYY-MM-DD,
+    the most recent day by default)."""
     method = 'flickr.interestingness.getList'
-    data = _doget(method)
-    photos = []
-    if isinstance(data.rsp.photos.photo , list):
-        for photo in data.rsp.photos.photo:
-            photos.append(_parse_photo(photo))
-    else:
-        photos = [_parse_photo(data.rsp.photos.photo)]
-    return photos
+    data = _doget(method, date=date, extras=extras, per_page=per_page,
+                  page=page)
+    return _parse_photos(data.rsp.photos)
 
 def galleries_create(title, description, primary_photo_id=None):
     """Create a new gallery."""
@@ -1088,18 +1204,30 @@ def galleries_create(title, description, primary_photo_id=None):
     elif primary_photo_id is not None:
         _dopost(method, auth=True, title=title, description=description)
 
-def galleries_getList(user_id='', per_page='', page=''):
-    """Returns list of Gallery objects."""
+def galleries_getPhotos(gallery_id, extras='', per_page='', page='',
+                        all_pages=False, concurrency=None):
+    """Returns the list of Photo objects in a gallery, in gallery order, of
+    page or of every page with all_pages=True (see _all_pages).
+    See Gallery.getPhotos for the extras."""
+    if all_pages:
+        return _all_pages(galleries_getPhotos_iter, per_page, concurrency,
+                          gallery_id, extras=extras)
+    method = 'flickr.galleries.getPhotos'
+    data = _doget(method, gallery_id=gallery_id, extras=extras, \
+                  per_page=per_page, page=page)
+    return [photo for photo, _ in _parse_gallery_photos(data.rsp.photos)]
+
+def galleries_getList(user_id='', per_page='', page='', all_pages=False,
+                      concurrency=None):
+    """Returns list of Gallery objects, of page or of every page with
+    all_pages=True (see _all_pages)."""
+    if all_pages:
+        return _all_pages(galleries_getList_iter, per_page, concurrency,
+                          user_id)
     method = 'flickr.galleries.getList'
     data = _doget(method, auth=False, user_id=user_id, per_page=per_page, \
                   page=page)
-    galleries = []
-    if isinstance(data.rsp.galleries.gallery, list):
-        for gallery in data.rsp.galleries.gallery:
-            galleries.append(_parse_gallery(gallery))
-    else:
-        galleries = [_parse_gallery(data.rsp.galleries.gallery)]
-    return galleries
+    return _parse_galleries(data.rsp.galleries)
 
 def test_login():
     method = 'flickr.test.login'
@@ -1113,41 +1241,489 @@ def test_echo():
     return data.rsp.stat
 
 
+#paged listings
+
+class _Background(object):
+    """Calls func in a thread of its own; result() waits for what it
+    returned or raised."""
+
+    def __init__(self, func):
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(func, ))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func):
+        try:
+            self._result = func()
+        except Exception as e:
+            self._error = e
+
+    def result(self):
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+class Pages(object):
+    """Iterates over the items of every page of a paged API method, page
+    after page, while the next prefetch pages are fetched in the background,
+    at the same time. Only those pages are held at once, however long the
+    listing is.
+
+    container picks the element with the page attributes out of a response
+    and parse turns it into a list of items. The number of pages and total
+    of items come from the first response, fetched when they are read or
+    on iteration. The pages are fetched with the client in use when the
+    Pages is made.
+    """
+
+    def __init__(self, method, container, parse, params=None, auth=False,
+                 per_page=500, prefetch=1):
+        self.method = method
+        self.container = container
+        self.parse = parse
+        self.params = params or {}
+        self.auth = auth
+        self.per_page = per_page
+        self.prefetch = prefetch
+        # the pages fetched in the background use it too
+        self.client = current_client()
+        self._first = None
+
+    def _page(self, page):
+        data = self.client.doget(self.method, auth=self.auth,
+                                 per_page=self.per_page, page=page,
+                                 **self.params)
+        return self.container(data.rsp)
+
+    def _first_page(self):
+        if self._first is None:
+            self._first = self._page(1)
+        return self._first
+
+    @property
+    def pages(self):
+        return int(getattr(self._first_page(), 'pages', None) or 1)
+
+    @property
+    def total(self):
+        return int(getattr(self._first_page(), 'total', None) or 0)
+
+    def __iter__(self):
+        element = self._first_page()
+        pages = self.pages
+        next_page = 2
+        pending = collections.deque()
+        while True:
+            # Ask for the next pages before going through this one
+            while next_page <= pages and len(pending) < self.prefetch:
+                pending.append(_Background(partial(self._page, next_page)))
+                next_page += 1
+            for item in self.parse(element):
+                yield item
+            if pending:
+                element = pending.popleft().result()
+            elif next_page <= pages:
+                element = self._page(next_page)
+                next_page += 1
+            else:
+                break
+
+def _all_pages(iterate, per_page, concurrency, *args, **kwargs):
+    """The list of the items of every page of the iterator function iterate
+    (like photos_search_iter), fetching up to concurrency (by default
+    PAGE_CONCURRENCY) pages at the same time, once the first page told how
+    many there are. per_page defaults to 500, the most Flickr allows."""
+    if concurrency is None:
+        concurrency = PAGE_CONCURRENCY
+    return list(iterate(*args, per_page=per_page or 500,
+                        prefetch=concurrency, **kwargs))
+
+def photos_search_iter(auth=False, per_page=500, prefetch=1, **params):
+    """Iterates over the Photo objects of every page of photos_search,
+    which takes the same params. See Pages."""
+    return Pages('flickr.photos.search', attrgetter('photos'), _parse_photos,
+                 params, auth=auth, per_page=per_page, prefetch=prefetch)
+
+def photos_recentlyUpdated_iter(min_date, extras='', per_page=500, prefetch=1):
+    """Iterates over the Photo objects of every page of
+    photos_recentlyUpdated. See Pages."""
+    return Pages('flickr.photos.recentlyUpdated', attrgetter('photos'),
+                 _parse_photos, dict(min_date=min_date, extras=extras),
+                 auth=True, per_page=per_page, prefetch=prefetch)
+
+def people_getPublicPhotos_iter(user_id, extras='', per_page=500, prefetch=1):
+    """Iterates over the Photo objects of every page of
+    people_getPublicPhotos. See Pages."""
+    return Pages('flickr.people.getPublicPhotos', attrgetter('photos'),
+                 _parse_photos, dict(user_id=user_id, extras=extras),
+                 per_page=per_page, prefetch=prefetch)
+
+def favorites_getList_iter(user_id='', extras='', per_page=500, prefetch=1):
+    """Iterates over the Photo objects of every page of favorites_getList.
+    See Pages."""
+    return Pages('flickr.favorites.getList', attrgetter('photos'),
+                 _parse_photos, dict(user_id=user_id, extras=extras),
+                 auth=True, per_page=per_page, prefetch=prefetch)
+
+def photosets_getPhotos_iter(photoset_id, extras='', per_page=500, prefetch=1):
+    """Iterates over the Photo objects of every page of
+    photosets_getPhotos. See Pages."""
+    return Pages('flickr.photosets.getPhotos', attrgetter('photoset'),
+                 _parse_photoset_photos,
+                 dict(photoset_id=photoset_id, extras=extras),
+                 per_page=per_page, prefetch=prefetch)
+
+def galleries_getPhotos_iter(gallery_id, extras='', per_page=500, prefetch=1):
+    """Iterates over the Photo objects of every page of
+    galleries_getPhotos. See Pages."""
+    return Pages('flickr.galleries.getPhotos', attrgetter('photos'),
+                 lambda photos: [photo for photo, _ in
+                                 _parse_gallery_photos(photos)],
+                 dict(gallery_id=gallery_id, extras=extras),
+                 per_page=per_page, prefetch=prefetch)
+
+def galleries_getList_iter(user_id='', per_page=500, prefetch=1):
+    """Iterates over the Gallery objects of every page of
+    galleries_getList. See Pages."""
+    return Pages('flickr.galleries.getList', attrgetter('galleries'),
+                 _parse_galleries, dict(user_id=user_id),
+                 per_page=per_page, prefetch=prefetch)
+
+
 #useful methods
 
-def _doget(method, auth=False, **params):
-    #uncomment to check you aren't killing the flickr server
-    #print "***** do get %s" % method
+# the clients activated in each thread, innermost last
+_local = threading.local()
+
+# for the parameters of FlickrClient made when not given
+_NEW = object()
+
+def current_client():
+    """The FlickrClient the module functions and objects use in this thread:
+    the innermost one activated with a with block, or default_client."""
+    clients = getattr(_local, 'clients', None)
+    return clients[-1] if clients else default_client
+
+class FlickrClient(object):
+    """A Flickr API client with its own credentials, host, response format,
+    timeouts, connection pool, throttle, response cache and single flight.
+    It is safe to use from several threads, and clients with other
+    credentials can be used in the same process.
+
+    Requests are made with doget and dopost. The module functions and
+    objects (photos_search, Photo, ...) use the client of the with block
+    they are called in, in the same thread:
+
+        client = FlickrClient(api_key='...', api_secret='...')
+        with client:
+            photos = photos_search(user_id='...')
+            titles = [photo.title for photo in photos]
+
+    Objects load their fields lazily with the client in use when they are
+    read. Outside of with blocks it is default_client, configured by the
+    module globals (API_KEY, HOST, pool, ...). pool, throttle, responses and
+    flights are made if not given; set responses or flights to None to do
+    without.
+    """
+
+    def __init__(self, api_key='', api_secret='', api_token=None, auth=False,
+                 host='https://flickr.com', format='xml', connect_timeout=10,
+                 read_timeout=30, pool=None, throttle=None, responses=_NEW,
+                 flights=_NEW, stats=None):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.api_token = api_token
+        self.auth = auth
+        self.host = host
+        self.format = format
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool = pool if pool is not None else ConnectionPool()
+        self.throttle = throttle if throttle is not None else Throttle()
+        self.responses = responses if responses is not _NEW else ResponseCache()
+        self.flights = flights if flights is not _NEW else SingleFlight()
+        self.stats = stats
+
+    def __enter__(self):
+        """Make this the client of the module functions in this thread, until
+        the with block ends."""
+        if not hasattr(_local, 'clients'):
+            _local.clients = []
+        _local.clients.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.clients.pop()
+
+    def doget(self, method, auth=False, **params):
+        """GET the API method and return the checked data of the response,
+        the kept one if any."""
+        #uncomment to check you aren't killing the flickr server
+        #print "***** do get %s" % method
+
+        url = self.get_url(method, auth, params)
+
+        #another useful debug print statement
+        if debug:
+            print("_doget", url)
+
+        responses = self.responses
+        key = self.response_key(method, auth, params)
+        if key is not None:
+            data = responses.get(key)
+            if data is not None:
+                return data
+
+        def get():
+            data = self.throttle.call(lambda: self.request(method, url),
+                                      _is_transient)
+            if key is not None:
+                responses.set(key, method, data)
+            return data
+
+        if self.flights is None or not is_read_method(method):
+            return get()
+        return self.flights.call(url, get)
+
+    def response_key(self, method, auth, params, response_format=None):
+        """The key of the response to a GET of method in responses, or None
+        if it isn't kept (authenticated requests and write methods)."""
+        responses = self.responses
+        if responses is None or self.is_authenticated(auth) or \
+                not responses.ttl(method):
+            return None
+        params = _prepare_params(self.format_params(dict(params),
+                                                    response_format))
+        # Empty parameters are the same as none
+        params = sorted((key, value) for key, value in params.items()
+                        if value not in ('', None))
+        return '%s%s/?api_key=%s&method=%s&%s' % (self.host, API, self.api_key,
+                                                 method, urlencode(params))
+
+    def get_url(self, method, auth=False, params=None, response_format=None):
+        """Build the REST url of a GET request for method."""
+        params = _prepare_params(self.format_params(dict(params or {}),
+                                                    response_format))
+        return '%s%s/?api_key=%s&method=%s&%s%s'% \
+               (self.host, API, self.api_key, method, urlencode(params),
+                       self.auth_url_suffix(method, auth, params))
+
+    def dopost(self, method, auth=False, **params):
+        """POST the API method and return the checked data of the
+        response."""
+        #uncomment to check you aren't killing the flickr server
+        #print "***** do post %s" % method
+
+        params = _prepare_params(self.format_params(params))
+        url = '%s%s/?api_key=%s%s'% \
+              (self.host, API, self.api_key,
+               self.auth_url_suffix(method, auth, params))
+
+        # There's no reason this can't be str(urlencode(params)). I just wanted to
+        # have it the same as the rest.
+        payload = '%s' % (urlencode(params))
+
+        #another useful debug print statement
+        if debug:
+            print("_dopost url", url)
+            print("_dopost payload", payload)
+
+        try:
+            # Writes might have been done, they are not retried
+            return self.throttle.call(lambda: self.request(method, url, payload),
+                                      _is_transient, retry=False)
+        finally:
+            # Even if it failed, the write may have been done
+            self.forget_responses(params)
+
+    def forget_responses(self, params):
+        """Forget the kept responses about the objects a write with params
+        changes, by their WRITE_ID_PARAMS."""
+        responses = self.responses
+        if responses is None:
+            return
+        for name in WRITE_ID_PARAMS:
+            if params.get(name) not in ('', None):
+                responses.discard(name, params[name])
+
+    def request(self, method, url, data=None):
+        """Request url (for the API method) and return the checked data of
+        the response, telling stats about it."""
+        start = time.time()
+        response = None
+        ok = False
+        try:
+            response = self.urlopen(url, data)
+            result = _get_data(self.parse_response(response))
+            ok = True
+            return result
+        finally:
+            stats = self.stats
+            if stats is not None:
+                stats.record_call(method, time.time() - start,
+                                  getattr(response, 'bytes_read', 0), ok)
+
+    def urlopen(self, url, data=None):
+        """Open url on a pooled keep-alive connection."""
+        return self.pool.urlopen(url, data,
+                                 connect_timeout=self.connect_timeout,
+                                 read_timeout=self.read_timeout)
+
+    def format_params(self, params, response_format=None):
+        """Add the parameters selecting the response format (default:
+        format)."""
+        if (response_format or self.format) == 'json':
+            params = dict(params, format='json', nojsoncallback=1)
+        return params
+
+    def parse_response(self, source, response_format=None):
+        """Parse a response in response_format (default: format)."""
+        if (response_format or self.format) == 'json':
+            return parse_json(source)
+        return parse(source)
+
+    def api_sig(self, params):
+        """Generate API signature."""
+        token = self.user_token()
+        parameters = ['api_key', 'auth_token']
+        for item in params.items():
+            parameters.append(item[0])
+        parameters.sort()
+
+        api_string = [self.api_secret]
+
+        for item in parameters:
+            for chocolate in params.items():
+                if item == chocolate[0]:
+                    api_string.append(item)
+                    api_string.append(str(chocolate[1]))
+            if item == 'api_key':
+                api_string.append('api_key')
+                api_string.append(self.api_key)
+            if item == 'auth_token':
+                api_string.append('auth_token')
+                api_string.append(token)
+
+        api_signature = hashlib.md5(''.join(api_string).encode('utf-8')).hexdigest()
+
+        return api_signature
+
+    def is_authenticated(self, auth):
+        """Whether a request made with auth is authenticated, like
+        auth_url_suffix decides."""
+        return auth != False or self.auth != False
+
+    def auth_url_suffix(self, method, auth, params):
+        """Figure out whether we want to authorize, and if so, construct a
+        suitable URL suffix to pass to the Flickr API."""
+        authentication = False
+
+        # auth may be passed in via the API, the auth attribute may be set
+        # for every request. We do a few more checks than may seem necessary
+        # because we allow the 'auth' parameter to actually contain the
+        # authentication token, not just True/False.
+        if auth or self.auth:
+            token = self.user_token()
+            authentication = True
+        elif auth != False:
+            token = auth
+            authentication = True
+        elif self.auth != False:
+            token = self.auth
+            authentication = True
+
+        # If we're not authenticating, no suffix is required.
+        if not authentication:
+            return ''
+
+        # The signature covers the method, the params are left alone
+        full_params = dict(params)
+        full_params['method'] = method
+
+        return '&auth_token=%s&api_sig=%s' % (token, self.api_sig(full_params))
+
+    def user_token(self):
+        """The API token, read from tokenFile in tokenPath if not given."""
+        # This method allows you flickr.py to retrive the saved token
+        # as once the token for a program has been got from flickr,
+        # it cannot be got again, so flickr.py saves it in a file
+        # called token.txt (default) somewhere.
+        if self.api_token is None:
+            with open(os.path.join(tokenPath, tokenFile), 'r') as f:
+                self.api_token = f.read()
+        return self.api_token
+
+def _module_setting(name):
+    """A property reading and writing the module global name."""
+    def fget(self):
+        return globals()[name]
+
+    def fset(self, value):
+        globals()[name] = value
+    return property(fget, fset)
+
+class _ModuleClient(FlickrClient):
+    """The client configured by the module globals, which may be changed at
+    any time."""
+
+    api_key = _module_setting('API_KEY')
+    api_secret = _module_setting('API_SECRET')
+    api_token = _module_setting('API_TOKEN')
+    auth = _module_setting('AUTH')
+    host = _module_setting('HOST')
+    format = _module_setting('FORMAT')
+    connect_timeout = _module_setting('CONNECT_TIMEOUT')
+    read_timeout = _module_setting('READ_TIMEOUT')
+    pool = _module_setting('pool')
+    throttle = _module_setting('throttle')
+    responses = _module_setting('responses')
+    flights = _module_setting('flights')
+    stats = _module_setting('stats')
+
+    def __init__(self):
+        pass
+
+# the client of the module functions outside of with blocks
+default_client = _ModuleClient()
 
-    params = _prepare_params(params)
-    url = '%s%s/?api_key=%s&method=%s&%s%s'% \
-          (HOST, API, API_KEY, method, urlencode(params),
-                  _get_auth_url_suffix(method, auth, params))
+def _doget(method, auth=False, **params):
+    return current_client().doget(method, auth, **params)
 
-    #another useful debug print statement
-    if debug:
-        print("_doget", url)
+def _response_key(method, auth, params, response_format=None):
+    return current_client().response_key(method, auth, params, response_format)
 
-    return _get_data(minidom.parse(urlopen(url)))
+def _get_url(method, auth=False, params=None, response_format=None):
+    return current_client().get_url(method, auth, params, response_format)
 
 def _dopost(method, auth=False, **params):
-    #uncomment to check you aren't killing the flickr server
-    #print "***** do post %s" % method
-
-    params = _prepare_params(params)
-    url = '%s%s/?api_key=%s%s'% \
-          (HOST, API, API_KEY, _get_auth_url_suffix(method, auth, params))
+    return current_client().dopost(method, auth, **params)
+
+def _request(method, url, data=None):
+    return current_client().request(method, url, data)
+
+def _is_transient(error):
+    """Whether a request that failed with error may succeed when retried."""
+    if isinstance(error, HTTPError):
+        return error.code in TRANSIENT_STATUSES
+    if isinstance(error, FlickrError):
+        return error.code in TRANSIENT_ERROR_CODES
+    # Responses cut short or corrupted on the way
+    if isinstance(error, (http_client.HTTPException, zlib.error)):
+        return True
+    # Connection failures and timeouts
+    return isinstance(error, (URLError, socket.error))
 
-    # There's no reason this can't be str(urlencode(params)). I just wanted to
-    # have it the same as the rest.
-    payload = '%s' % (urlencode(params))
+def _urlopen(url, data=None):
+    return current_client().urlopen(url, data)
 
-    #another useful debug print statement
-    if debug:
-        print("_dopost url", url)
-        print("_dopost payload", payload)
+def _format_params(params, response_format=None):
+    return current_client().format_params(params, response_format)
 
-    return _get_data(minidom.parse(urlopen(url, payload)))
+def _parse_response(source, response_format=None):
+    return current_client().parse_response(source, response_format)
 
 def _prepare_params(params):
     """Convert lists to strings with ',' between items."""
@@ -1156,83 +1732,132 @@ def _prepare_params(params):
             params[key] = ','.join([item for item in value])
     return params
 
-def _get_data(xml):
-    """Given a bunch of XML back from Flickr, we turn it into a data structure
-    we can deal with (after checking for errors)."""
-    data = unmarshal(xml)
+def _get_data(data):
+    """Given the data structure parsed from Flickr's response, check it for
+    errors and hand it back."""
     if not data.rsp.stat == 'ok':
         msg = "ERROR [%s]: %s" % (data.rsp.err.code, data.rsp.err.msg)
-        raise FlickrError(msg)
+        raise FlickrError(msg, code=str(data.rsp.err.code))
     return data
 
 def _get_api_sig(params):
-    """Generate API signature."""
-    token = userToken()
-    parameters = ['api_key', 'auth_token']
-    for item in params.items():
-        parameters.append(item[0])
-    parameters.sort()
-
-    api_string = [API_SECRET]
-
-    for item in parameters:
-        for chocolate in params.items():
-            if item == chocolate[0]:
-                api_string.append(item)
-                api_string.append(str(chocolate[1]))
-        if item == 'api_key':
-            api_string.append('api_key')
-            api_string.append(API_KEY)
-        if item == 'auth_token':
-            api_string.append('auth_token')
-            api_string.append(token)
-
-    api_signature = hashlib.md5(''.join(api_string)).hexdigest()
-
-    return api_signature
+    return current_client().api_sig(params)
+
+def _is_authenticated(auth):
+    return current_client().is_authenticated(auth)
 
 def _get_auth_url_suffix(method, auth, params):
-    """Figure out whether we want to authorize, and if so, construct a suitable
-    URL suffix to pass to the Flickr API."""
-    authentication = False
-
-    # auth may be passed in via the API, AUTH may be set globally (in the same
-    # manner as API_KEY, etc). We do a few more checks than may seem necessary
-    # because we allow the 'auth' parameter to actually contain the
-    # authentication token, not just True/False.
-    if auth or AUTH:
-        token = userToken()
-        authentication = True
-    elif auth != False:
-        token = auth
-        authentication = True
-    elif AUTH != False:
-        token = AUTH
-        authentication = True
-
-    # If we're not authenticating, no suffix is required.
-    if not authentication:
-        return ''
-
-    full_params = params
-    full_params['method'] = method
-
-    return '&auth_token=%s&api_sig=%s' % (token, _get_api_sig(full_params))
+    return current_client().auth_url_suffix(method, auth, params)
 
 def _parse_photo(photo):
-    """Create a Photo object from photo data."""
-    owner = User(photo.owner)
+    """Create a Photo object from photo data.
+
+    Fields given by extras (see EXTRAS_INFO and EXTRAS_SIZES) are set too,
+    so that reading them doesn't load the photo."""
+    owner = User(photo.owner, username=getattr(photo, 'ownername', None))
     title = photo.title
-    ispublic = photo.ispublic
-    isfriend = photo.isfriend
-    isfamily = photo.isfamily
+    # Photoset listings only have these with the privacy extras
+    ispublic = getattr(photo, 'ispublic', None)
+    isfriend = getattr(photo, 'isfriend', None)
+    isfamily = getattr(photo, 'isfamily', None)
     secret = photo.secret
     server = photo.server
+    farm = getattr(photo, 'farm', None)
+    # The photo page, as getInfo has it, is only known with the path_alias
+    # extra (which is empty for users without one).
+    url = None
+    if hasattr(photo, 'pathalias'):
+        url = 'https://www.flickr.com/photos/%s/%s/' % \
+              (photo.pathalias or photo.owner, photo.id)
+    description = getattr(photo, 'description', None)
+    if description is not None:
+        description = description.text
     p = Photo(photo.id, owner=owner, title=title, ispublic=ispublic,\
               isfriend=isfriend, isfamily=isfamily, secret=secret, \
-              server=server)
+              server=server, farm=farm, url=url, sizes=_parse_size_extras(photo),
+              description=description,
+              license=getattr(photo, 'license', None),
+              dateuploaded=getattr(photo, 'dateupload', None),
+              dateposted=getattr(photo, 'dateupload', None),
+              datetaken=getattr(photo, 'datetaken', None),
+              takengranularity=getattr(photo, 'datetakengranularity', None))
     return p
 
+def _parse_size_extras(photo):
+    """Create a list of size dicts, like _parse_sizes, from the url_* extras
+    of photo data. Returns None without any."""
+    ret = []
+    for suffix, label in SIZE_EXTRAS:
+        source = getattr(photo, 'url_' + suffix, None)
+        if source:
+            ret.append({'label': label, 'source': source, 'text': '',
+                        'width': int(getattr(photo, 'width_' + suffix)),
+                        'height': int(getattr(photo, 'height_' + suffix)),
+                        'url': 'https://www.flickr.com/photos/%s/%s/sizes/%s/' %
+                               (getattr(photo, 'pathalias', '') or photo.owner,
+                                photo.id, suffix)})
+    return ret or None
+
+def _parse_photos(photos):
+    """Create a list of Photo objects from a <photos> element."""
+    # There may be no photos at all (may be been paging too far).
+    if not hasattr(photos, 'photo'):
+        return []
+    if isinstance(photos.photo, list):
+        return [_parse_photo(photo) for photo in photos.photo]
+    return [_parse_photo(photos.photo)]
+
+def _parse_photoset_photos(photoset):
+    """Create a list of Photo objects from a <photoset> element."""
+    if not hasattr(photoset, 'photo'):
+        return []
+    photos = photoset.photo
+    if not isinstance(photos, list):
+        photos = [photos]
+    # The owner is given once, for the whole photoset
+    for photo in photos:
+        if not hasattr(photo, 'owner'):
+            photo.owner = photoset.owner
+    return [_parse_photo(photo) for photo in photos]
+
+def _parse_gallery_photos(photos):
+    """Create a list of (Photo, comment) tuples from the <photos> element of
+    a gallery. The comment is '' for photos without one."""
+    if not hasattr(photos, 'photo'):
+        return []
+    photos = photos.photo
+    if not isinstance(photos, list):
+        photos = [photos]
+    ret = []
+    for photo in photos:
+        comment = ''
+        if str(photo.has_comment) == '1':
+            comment = photo.comment.text
+        ret.append((_parse_photo(photo), comment))
+    return ret
+
+def _parse_sizes(sizes):
+    """Create a list of size dicts from a <sizes> element."""
+    ret = []
+    # The given props are those that we return and the according types, since
+    # return width and height as string would make "75">"100" be True, which
+    # is just error prone.
+    props = {'url':str,'width':int,'height':int,'label':str,'source':str,'text':str}
+    for psize in sizes.size:
+        d = {}
+        for prop,convert_to_type in props.items():
+            d[prop] = convert_to_type(getattr(psize, prop))
+        ret.append(d)
+    return ret
+
+def _parse_galleries(galleries):
+    """Create a list of Gallery objects from a <galleries> element."""
+    if not hasattr(galleries, 'gallery'):
+        return []
+    if isinstance(galleries.gallery, list):
+        return [_parse_gallery(gallery) for gallery in galleries.gallery]
+    return [_parse_gallery(galleries.gallery)]
+
 def _parse_gallery(gallery):
     """Create a Gallery object from gallery data."""
     # This might not work!! NEEDS TESTING
@@ -1297,6 +1922,107 @@ def unmarshal(element):
         setattr(rc, 'text', text)
     return rc
 
+class _Unmarshaller(object):
+    """expat handlers building the same structure as unmarshal, in one pass
+    over the document and without building a DOM first."""
+
+    def __init__(self):
+        self.root = Bag()
+        # (bag, has child elements, text parts) for every open element
+        self.stack = [(self.root, [True], [])]
+
+    def start_element(self, name, attributes):
+        parent, has_children, _ = self.stack[-1]
+        has_children[0] = True
+
+        rc = Bag()
+        for key, value in attributes.items():
+            setattr(rc, key, value)
+
+        current = getattr(parent, name, None)
+        if hasattr(parent, name):
+            if type(current) != type([]):
+                current = [current]
+                setattr(parent, name, current)
+            current.append(rc)
+        elif name == 'Details':
+            # make the first Details element a key, see unmarshal
+            setattr(parent, name, [rc])
+        else:
+            setattr(parent, name, rc)
+
+        self.stack.append((rc, [False], []))
+
+    def end_element(self, name):
+        rc, has_children, text = self.stack.pop()
+        if not has_children[0]:
+            rc.text = ''.join(text)
+
+    def character_data(self, data):
+        self.stack[-1][2].append(data)
+
+def parse(source):
+    """Parse an XML response from a string or a file-like object into the
+    same data structure that unmarshal builds from its DOM."""
+    handler = _Unmarshaller()
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start_element
+    parser.EndElementHandler = handler.end_element
+    parser.CharacterDataHandler = handler.character_data
+    if hasattr(source, 'read'):
+        parser.ParseFile(source)
+    else:
+        parser.Parse(source, True)
+    return handler.root
+
+def _json_text(value):
+    if isinstance(value, bool):
+        return value and u'1' or u'0'
+    if value is None:
+        return u''
+    return six.text_type(value)
+
+def _unmarshal_json(value):
+    """Turn a JSON object into the Bag unmarshal would build for the same
+    XML element: attributes and text (_content) become attributes and text,
+    nested objects child elements, and a list of one item a single child."""
+    rc = Bag()
+    has_children = False
+    for key, item in value.items():
+        if key == '_content':
+            rc.text = _json_text(item)
+        elif isinstance(item, dict):
+            setattr(rc, key, _unmarshal_json(item))
+            has_children = True
+        elif isinstance(item, list):
+            items = [_unmarshal_json(i) if isinstance(i, dict) else _json_text(i)
+                     for i in item]
+            if items:
+                setattr(rc, key, items if len(items) > 1 else items[0])
+                has_children = True
+        else:
+            setattr(rc, key, _json_text(item))
+    if not has_children and not hasattr(rc, 'text'):
+        rc.text = u''
+    return rc
+
+def parse_json(source):
+    """Parse a JSON response (format=json&nojsoncallback=1) from a string or
+    a file-like object into the same data structure as parse."""
+    if hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, bytes):
+        source = source.decode('utf-8')
+    rsp = _unmarshal_json(json.loads(source))
+    if rsp.stat != 'ok':
+        rsp.err = Bag()
+        rsp.err.code = getattr(rsp, 'code', u'')
+        rsp.err.msg = getattr(rsp, 'message', u'')
+    data = Bag()
+    data.rsp = rsp
+    return data
+
 #unique items from a list from the cookbook
 def uniq(alist):    # Fastest without order preserving
     set = {}
@@ -1357,7 +2083,8 @@ class Auth():
     def getFrob(self):
         """Returns a frob that is used in authentication"""
         method = 'flickr.auth.getFrob'
-        sig_str = API_SECRET + 'api_key' + API_KEY + 'method' + method
+        client = current_client()
+        sig_str = client.api_secret + 'api_key' + client.api_key + 'method' + method
         signature_hash = hashlib.md5(sig_str).hexdigest()
         data = _doget(method, auth=False, api_sig=signature_hash)
         return data.rsp.frob.text
@@ -1365,36 +2092,26 @@ class Auth():
     def loginLink(self, permission, frob):
         """Generates a link that the user should be sent to"""
         myAuth = Auth()
-        sig_str = API_SECRET + 'api_key' + API_KEY + 'frob' + frob + 'perms' + permission
+        client = current_client()
+        sig_str = client.api_secret + 'api_key' + client.api_key + 'frob' + frob + 'perms' + permission
         signature_hash = hashlib.md5(sig_str).hexdigest()
         perms = permission
-        link = "http://flickr.com/services/auth/?api_key=%s&perms=%s&frob=%s&api_sig=%s" % (API_KEY, perms, frob, signature_hash)
+        link = "http://flickr.com/services/auth/?api_key=%s&perms=%s&frob=%s&api_sig=%s" % (client.api_key, perms, frob, signature_hash)
         return link
 
     def getToken(self, frob):
         """This token is what needs to be used in future API calls"""
         method = 'flickr.auth.getToken'
-        sig_str = API_SECRET + 'api_key' + API_KEY + 'frob' + frob + 'method' + method
+        client = current_client()
+        sig_str = client.api_secret + 'api_key' + client.api_key + 'frob' + frob + 'method' + method
         signature_hash = hashlib.md5(sig_str).hexdigest()
         data = _doget(method, auth=False, api_sig=signature_hash,
-                      api_key=API_KEY, frob=frob)
+                      api_key=client.api_key, frob=frob)
         return data.rsp.auth.token.text
 
 def userToken():
-    global API_TOKEN
-    # This method allows you flickr.py to retrive the saved token
-    # as once the token for a program has been got from flickr,
-    # it cannot be got again, so flickr.py saves it in a file
-    # called token.txt (default) somewhere.
-    if API_TOKEN is not None:
-        return API_TOKEN
-    if not tokenPath == '':
-        f = file(os.path.join(tokenPath, tokenFile), 'r')
-    else:
-        f = file(tokenFile, 'r')
-    API_TOKEN = f.read()
-    f.close()
-    return API_TOKEN
+    """The API token of the client in use. See FlickrClient.user_token."""
+    return current_client().user_token()
 
 def getUserPhotosURL(userid):
     """Returns user URL in an array (to access, use array[1])"""
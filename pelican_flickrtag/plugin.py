@@ -4,15 +4,36 @@ Embed Flickr Images in Pelican Articles and Pages
 =================================================
 
 """
+import hashlib
+import json
 import logging
-import pickle
 import re
+import time
+
+from multiprocessing.pool import ThreadPool
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 import pelican_flickrtag.flickr as api_client
 
+from pelican_flickrtag.cache import open_cache
+from pelican_flickrtag.responses import ResponseCache
+from pelican_flickrtag.stats import BuildStats
+from pelican_flickrtag.transport import Throttle
+
 from pelican import signals
 
-flickr_regex = re.compile(r'<p>(\[flickr:id\=([0-9]+)(?:,title\=(.+))?\])</p>')
+try:
+    from pelican_flickrtag import aioflickr
+except (ImportError, SyntaxError):
+    aioflickr = None
+
+# [flickr:id=...] photos, and [flickrset:id=...] / [flickrgallery:id=...] grids
+flickr_regex = re.compile(
+    r'<p>(\[flickr(set|gallery)?:id\=([0-9-]+)(?:,title\=(.+))?\])</p>')
 default_template = """<p class="caption-container">
     <a class="caption" href="{{url}}" target="_blank">
         <img src="{{raw_url}}"
@@ -26,18 +47,86 @@ default_template = """<p class="caption-container">
     </a>
     <span class="caption-text muted">{{title}}</span>
 </p>"""
+default_grid_template = """<div class="flickr-grid">
+    {% for photo in photos %}
+    <a class="flickr-grid-item" href="{{photo.url}}" target="_blank">
+        <img src="{{photo.raw_url}}"
+            alt="{{photo.title}}"
+            title="{{photo.title}}"
+            {% if FLICKR_TAG_INCLUDE_DIMENSIONS %}
+                width="{{photo.width}}"
+                height="{{photo.height}}"
+            {% endif %} />
+    </a>
+    {% endfor %}
+    {% if title %}
+    <span class="caption-text muted">{{title}}</span>
+    {% endif %}
+</div>"""
+
+# The url of an image, by server, id, secret and size suffix, as the sources
+# of flickr.photos.getSizes and the url_* extras give it
+STATIC_URL = 'https://live.staticflickr.com/%s/%s_%s%s.jpg'
+
+# The url suffixes of the sizes that share the photo's secret
+SIZE_SUFFIXES = {
+    'Square': 's',
+    'Large Square': 'q',
+    'Thumbnail': 't',
+    'Small': 'm',
+    'Small 320': 'n',
+    'Medium': '',
+    'Medium 640': 'z',
+    'Medium 800': 'c',
+    'Large': 'b',
+}
 
 logger = logging.getLogger(__name__)
 
+# The generator attributes listing documents that can contain tags
+DOCUMENT_ATTRIBUTES = ('articles', 'translations', 'drafts',
+                       'drafts_translations', 'hidden_articles', 'pages',
+                       'hidden_pages', 'hidden_translations', 'draft_pages',
+                       'draft_translations')
+
+# The template variables set from a photo
+PHOTO_FIELDS = ('id', 'title', 'raw_url', 'url', 'width', 'height')
+
+# The fields of a cache entry set from flickr.photos.getInfo
+INFO_FIELDS = ('title', 'url', 'farm', 'server', 'secret')
+
+# The calls fetching the parts of a cache entry
+PHOTO_PARTS = ('info', 'sizes')
+
+# The template variables set from a photoset or gallery
+GRID_FIELDS = ('photos', 'title')
+
+# The api functions listing the photos of each kind of grid tag
+GROUP_LISTS = {
+    'set': 'photosets_getPhotos_iter',
+    'gallery': 'galleries_getPhotos_iter',
+}
+
+# Compiled templates and their source by theme, setting and template name,
+# shared by every build of the process
+_templates = {}
+
+# The Flickr clients by configuration, shared by every generator and build of
+# the process so they keep their connections and responses
+_clients = {}
+
+# The attributes of the client of a site given to flickr.default_client
+DEFAULT_CLIENT_ATTRIBUTES = ('api_key', 'api_secret', 'api_token', 'host',
+                             'format', 'connect_timeout', 'read_timeout',
+                             'pool', 'throttle', 'responses', 'flights')
+
 
 def setup_flickr(generator):
-    """Add Flickr api object to Pelican settings."""
+    """Add the Flickr api module and a client configured by the settings to
+    the generator."""
 
     for key in ('TOKEN', 'KEY', 'SECRET'):
-        try:
-            value = generator.settings['FLICKR_API_' + key]
-            setattr(api_client, 'API_' + key, value)
-        except KeyError:
+        if 'FLICKR_API_' + key not in generator.settings:
             logger.warning('[flickrtag]: FLICKR_API_%s is not defined in the configuration' % key)
 
     generator.flickr_api_client = api_client
@@ -45,115 +134,877 @@ def setup_flickr(generator):
     generator.settings.setdefault(
         'FLICKR_TAG_CACHE_LOCATION',
         '/tmp/com.chrisstreeter.flickrtag-images.cache')
+    generator.settings.setdefault('FLICKR_TAG_CACHE_BACKEND', 'sqlite')
+    generator.settings.setdefault('FLICKR_TAG_CACHE_REFRESH', False)
+    generator.settings.setdefault('FLICKR_TAG_FRAGMENT_CACHE', True)
     generator.settings.setdefault('FLICKR_TAG_INCLUDE_DIMENSIONS', False)
     generator.settings.setdefault('FLICKR_TAG_IMAGE_SIZE', 'Medium 640')
+    generator.settings.setdefault('FLICKR_TAG_TEMPLATE_NAME', None)
+    generator.settings.setdefault('FLICKR_TAG_GRID_TEMPLATE_NAME', None)
+    generator.settings.setdefault('FLICKR_TAG_GRID_IMAGE_SIZE', 'Large Square')
+    generator.settings.setdefault('FLICKR_TAG_FETCH_CONCURRENCY', 1)
+    generator.settings.setdefault('FLICKR_TAG_FETCH_ASYNC', False)
+    generator.settings.setdefault('FLICKR_TAG_BULK_OWNERS', [])
+    generator.settings.setdefault('FLICKR_TAG_RATE_LIMIT', None)
+    generator.settings.setdefault('FLICKR_TAG_RATE_BURST', 10)
+    generator.settings.setdefault('FLICKR_TAG_RETRIES', 3)
+    generator.settings.setdefault('FLICKR_TAG_STATS_FILE', None)
+    generator.settings.setdefault('FLICKR_TAG_RESPONSE_CACHE_SIZE', 1024)
+    generator.settings.setdefault('FLICKR_TAG_RESPONSE_CACHE_DISK', False)
+    generator.settings.setdefault('FLICKR_TAG_RESPONSE_TTLS', {})
+    generator.settings.setdefault('FLICKR_TAG_API_FORMAT', api_client.FORMAT)
+    generator.settings.setdefault('FLICKR_TAG_CONNECT_TIMEOUT',
+                                  api_client.CONNECT_TIMEOUT)
+    generator.settings.setdefault('FLICKR_TAG_READ_TIMEOUT',
+                                  api_client.READ_TIMEOUT)
+
+    client = generator.flickr_client = flickr_client(generator.settings)
+    # Code calling the api module (generator.flickr_api_client) outside of
+    # a with block of the client gets the default client, configured like
+    # the site as long as the process builds a single one
+    if len(_clients) == 1:
+        for name in DEFAULT_CLIENT_ATTRIBUTES:
+            setattr(api_client.default_client, name, getattr(client, name))
+    elif api_client.default_client.api_key != client.api_key:
+        logger.info('[flickrtag]: Several Flickr configurations in the process, '
+                    'flickr_api_client keeps the first one, use '
+                    'flickr_client for this site')
+
+
+def flickr_client(settings):
+    """The FlickrClient configured by the FLICKR_API_* and FLICKR_TAG_*
+    settings.
+
+    Sites with the same configuration share a client, those with another one
+    (a second account, other limits) get their own.
+    """
+    response_path = None
+    if settings['FLICKR_TAG_RESPONSE_CACHE_DISK']:
+        response_path = settings['FLICKR_TAG_CACHE_LOCATION'] + \
+            '.responses.sqlite3'
+    config = (settings.get('FLICKR_API_KEY', ''),
+              settings.get('FLICKR_API_SECRET', ''),
+              settings.get('FLICKR_API_TOKEN'),
+              api_client.HOST,
+              settings['FLICKR_TAG_API_FORMAT'],
+              settings['FLICKR_TAG_CONNECT_TIMEOUT'],
+              settings['FLICKR_TAG_READ_TIMEOUT'],
+              settings['FLICKR_TAG_RATE_LIMIT'],
+              settings['FLICKR_TAG_RATE_BURST'],
+              settings['FLICKR_TAG_FETCH_CONCURRENCY'],
+              settings['FLICKR_TAG_RETRIES'],
+              settings['FLICKR_TAG_RESPONSE_CACHE_SIZE'],
+              response_path,
+              tuple(sorted(settings['FLICKR_TAG_RESPONSE_TTLS'].items())))
+    client = _clients.get(config)
+    if client is None:
+        client = _clients[config] = api_client.FlickrClient(
+            api_key=settings.get('FLICKR_API_KEY', ''),
+            api_secret=settings.get('FLICKR_API_SECRET', ''),
+            api_token=settings.get('FLICKR_API_TOKEN'),
+            host=api_client.HOST,
+            format=settings['FLICKR_TAG_API_FORMAT'],
+            connect_timeout=settings['FLICKR_TAG_CONNECT_TIMEOUT'],
+            read_timeout=settings['FLICKR_TAG_READ_TIMEOUT'],
+            throttle=Throttle(
+                rate=settings['FLICKR_TAG_RATE_LIMIT'],
+                burst=settings['FLICKR_TAG_RATE_BURST'],
+                concurrency=settings['FLICKR_TAG_FETCH_CONCURRENCY'],
+                retries=settings['FLICKR_TAG_RETRIES']),
+            responses=ResponseCache(
+                size=settings['FLICKR_TAG_RESPONSE_CACHE_SIZE'],
+                path=response_path,
+                ttls=settings['FLICKR_TAG_RESPONSE_TTLS']))
+    return client
 
 
-def url_for_alias(photo, alias):
-    if alias == 'Medium 640':
-        url = photo.getMedium640()
+def url_for_alias(record, alias):
+    """The scheme-less image url of a photo in the size ``alias``, or in the
+    size size_for_alias falls back to if its sizes are known. None if the
+    entry doesn't have what it takes.
+
+    It is the source of the size when the entry has the sizes, and else is
+    built from the secret of the photo in the same form, so it doesn't
+    depend on the parts fetched.
+    """
+    size = size_for_alias(record.get('sizes') or [], alias)
+    if size is not None:
+        # The same size as the dimensions
+        url = size['source']
+    elif alias in SIZE_SUFFIXES and 'secret' in record:
+        # Larger sizes have their own secret, only their sources have it
+        suffix = SIZE_SUFFIXES[alias]
+        url = STATIC_URL % (record['server'], record['id'], record['secret'],
+                            '_' + suffix if suffix else '')
     else:
-        url = photo.getMedium()
+        return None
     url = url.replace('http:', '').replace('https:', '')
     return url
 
 
 def size_for_alias(sizes, alias):
-    if alias not in ('Medium 640', 'Medium'):
-        alias = 'Medium'
-    return [s for s in sizes if s['label'] == alias][0]
+    """The size ``alias`` in a getSizes table, or Medium if there is none,
+    or the largest size of a photo smaller than Medium. None if the table is
+    empty."""
+    fallback = None
+    for size in sizes:
+        if size['label'] == alias:
+            return size
+        if size['label'] == 'Medium':
+            fallback = size
+    if fallback is None and sizes:
+        fallback = max(sizes, key=lambda size: int(size['width']) *
+                       int(size['height']))
+    return fallback
 
 
-def replace_tags(generator, documents):
-    from jinja2 import Template
+def photo_record(photo, sizes, photo_id=None):
+    """Build the cache entry for a photo from its info and its sizes.
 
-    api = generator.flickr_api_client
-    if api is None:
-        logger.error('[flickrtag]: Unable to get the Flickr API object')
-        return
+    The entry holds everything needed to render any size with any title.
+    Either part may be None, for an entry with only the other one.
+    """
+    record = {'id': str(photo_id if photo is None else photo.id)}
+    if photo is not None:
+        record.update((field, getattr(photo, field)) for field in INFO_FIELDS)
+    if sizes is not None:
+        record['sizes'] = sizes
+    return record
 
-    tmp_file = generator.settings['FLICKR_TAG_CACHE_LOCATION']
 
-    include_dimensions = generator.settings['FLICKR_TAG_INCLUDE_DIMENSIONS']
-    size_alias = generator.settings['FLICKR_TAG_IMAGE_SIZE']
+def record_parts(record):
+    """The parts (see PHOTO_PARTS) a cache entry holds."""
+    parts = set()
+    if record is None or 'id' not in record:
+        # Entries of older versions hold a single size, and are fetched again
+        return parts
+    if all(field in record for field in INFO_FIELDS):
+        parts.add('info')
+    if 'sizes' in record:
+        parts.add('sizes')
+    return parts
 
-    photo_ids = set([])
-    for document in documents:
-        for match in flickr_regex.findall(document._content):
-            id, title = match[1:3]
-            fid = '{}-{}'.format(id, title) if title else id
-            photo_ids.add(fid)
 
-    photo_ids_found = len(photo_ids)
+def photo_fields(record, title, size_alias):
+    """The template variables for a photo in the size ``size_alias``.
+
+    Fields the entry doesn't have the parts for are left out.
+    """
+    fields = {'id': record['id'], 'title': title or record.get('title')}
+    raw_url = url_for_alias(record, size_alias)
+    if raw_url is not None:
+        fields['raw_url'] = raw_url
+    if 'url' in record:
+        fields['url'] = record['url']
+    size = size_for_alias(record.get('sizes') or [], size_alias)
+    if size is not None:
+        fields['width'] = size['width']
+        fields['height'] = size['height']
+        # The photo page is where its sizes page is
+        fields.setdefault('url', size['url'].split('sizes/')[0])
+    return fields
+
+
+def template_fields(generator, template, source):
+    """The photo fields (see PHOTO_FIELDS) a template renders.
+
+    Branches of ``{% if SETTING %}`` blocks not taken with the current
+    settings are skipped, where a setting the context doesn't have is false,
+    as Jinja renders it. All the fields are returned when the source can't
+    be analysed, or includes other templates.
+    """
+    from jinja2 import meta, nodes
+
+    if source is None:
+        return set(PHOTO_FIELDS)
+    ast = template.environment.parse(source)
+    if list(meta.find_referenced_templates(ast)):
+        return set(PHOTO_FIELDS)
 
+    context = LayeredContext(generator.context, template.globals)
+    # Not set by the template itself
+    undeclared = meta.find_undeclared_variables(ast)
+    names = set()
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, nodes.Name):
+            names.add(node.name)
+        elif isinstance(node, nodes.If) and isinstance(node.test, nodes.Name) \
+                and node.test.name not in PHOTO_FIELDS \
+                and node.test.name in undeclared:
+            if context.get(node.test.name):
+                stack.extend(node.body)
+            else:
+                stack.extend(getattr(node, 'elif_', []))
+                stack.extend(node.else_)
+            continue
+        stack.extend(node.iter_child_nodes())
+    return names & set(PHOTO_FIELDS) & undeclared
+
+
+def plan_parts(fields, titles, size_alias):
+    """The parts (see PHOTO_PARTS) needed to render ``fields`` of a photo for
+    tags with ``titles``, and the size ``size_alias``.
+
+    getInfo is only needed for a title some tag doesn't set itself, getSizes
+    for the dimensions or sizes with their own secret. Either one gives the
+    urls.
+    """
+    parts = set()
+    if 'width' in fields or 'height' in fields:
+        parts.add('sizes')
+    if 'raw_url' in fields and size_alias not in SIZE_SUFFIXES:
+        parts.add('sizes')
+    if 'title' in fields and not all(titles):
+        parts.add('info')
+    if not parts and ('url' in fields or 'raw_url' in fields):
+        parts.add('sizes')
+    return parts
+
+
+def fetch_photo(api, photo_id, parts=PHOTO_PARTS):
+    """Fetch the ``parts`` of the cache entry for a single photo id.
+
+    The entry is None when the photo can't be fetched.
+    """
+    logger.info('[flickrtag]: Fetching photo information for %s' % photo_id)
+    photo = api.Photo(id=int(photo_id))
     try:
-        with open(tmp_file, 'rb') as f:
-            photo_mapping = pickle.load(f)
-    except (IOError, EOFError, ValueError):
-        photo_mapping = {}
-    else:
-        # Get the difference of photo_ids and what have cached
-        cached_ids = set(photo_mapping.keys())
-        photo_ids = list(set(photo_ids) - cached_ids)
-
-    if photo_ids:
-        logger.info('[flickrtag]: Fetching photo information from Flickr...')
-        for fid in photo_ids:
-            logger.info('[flickrtag]: Fetching photo information for %s' % fid)
-            id, title = (fid.split('-', 1) + [''])[:2]
-            photo = api.Photo(id=int(id))
-            # Trigger the API call...
-            photo_mapping[fid] = {
-                'title': title or photo.title,
-                'raw_url': url_for_alias(photo, size_alias),
-                'url': photo.url,
-            }
-
-            if include_dimensions:
-                sizes = photo.getSizes()
-                size = size_for_alias(sizes, size_alias)
-                photo_mapping[fid]['width'] = size['width']
-                photo_mapping[fid]['height'] = size['height']
-
-        with open(tmp_file, 'wb') as f:
-            pickle.dump(photo_mapping, f)
+        # Trigger the API calls...
+        return photo_id, photo_record(
+            photo if 'info' in parts else None,
+            photo.getSizes() if 'sizes' in parts else None,
+            photo_id)
+    except api.REQUEST_ERRORS as e:
+        logger.error('[flickrtag]: Unable to fetch photo %s: %s' % (photo_id, e))
+        return photo_id, None
+
+
+def prefetch_owner_photos(api, owners, photo_ids, per_page=500,
+                          not_listed=None):
+    """Fetch the cache entries for ``photo_ids`` from the photo lists of
+    ``owners``.
+
+    Each page of flickr.photos.search carries the title, page url and every
+    size of up to ``per_page`` photos, instead of two calls per photo. The
+    lists are paged, the next page fetched while one is gone through, until
+    all the photos are found, or the list, newest first, reaches photos
+    older than any still wanted: photo ids grow with every upload, so those
+    of other accounts or deleted photos don't make every build page through
+    a whole account. Returns a dict of the entries found; the rest have to
+    be fetched one by one, as do those of a list that can't be fetched.
+    The ids not found when every list could be fetched are added to the
+    ``not_listed`` set, if given.
+    """
+    wanted = set(photo_ids)
+    records = {}
+    auth = api.current_client().api_token is not None
+    for owner in owners:
+        if not wanted:
+            break
+        logger.info('[flickrtag]: Fetching the photo list of %s' % owner)
+        photos = api.photos_search_iter(user_id=owner, extras=api.EXTRAS_SIZES,
+                                        sort='date-posted-desc', auth=auth,
+                                        per_page=per_page)
+        oldest = min(int(id) for id in wanted)
+        try:
+            for photo in photos:
+                id = str(photo.id)
+                if id in wanted:
+                    records[id] = photo_record(photo, photo.getSizes())
+                    wanted.discard(id)
+                    if not wanted:
+                        break
+                    oldest = min(int(id) for id in wanted)
+                elif int(id) < oldest:
+                    # The rest of the list is older still
+                    break
+        except api.REQUEST_ERRORS as e:
+            logger.error('[flickrtag]: Unable to fetch the photo list of %s: %s'
+                         % (owner, e))
+            not_listed = None
+    if not_listed is not None:
+        not_listed.update(wanted)
+    return records
+
+
+def fetch_group(api, kind, group_id, per_page=500, concurrency=1):
+    """Fetch the cache entries of the photos in a photoset or gallery.
+
+    Every page of the listing carries all the sizes of up to ``per_page``
+    photos, and up to ``concurrency`` pages are fetched at the same time.
+    Returns the entries in the order of the listing, or None if the listing
+    failed.
+    """
+    logger.info('[flickrtag]: Fetching the photos of %s %s' % (kind, group_id))
+    photos = getattr(api, GROUP_LISTS[kind])(group_id, extras=api.EXTRAS_SIZES,
+                                             per_page=per_page,
+                                             prefetch=max(1, concurrency))
+    try:
+        return [photo_record(photo, photo.getSizes()) for photo in photos]
+    except api.REQUEST_ERRORS as e:
+        logger.error('[flickrtag]: Unable to fetch the photos of %s %s: %s'
+                     % (kind, group_id, e))
+        return None
+
+
+def fetch_photos_async(client, photo_ids, concurrency, parts=PHOTO_PARTS):
+    """Fetch the cache entries for ``photo_ids`` on the asyncio client."""
+    fetched = aioflickr.fetch_photos([int(id) for id in photo_ids],
+                                     sizes='sizes' in parts,
+                                     info='info' in parts, limit=concurrency,
+                                     client=client)
+    records = {}
+    for id in photo_ids:
+        result = fetched[int(id)]
+        if isinstance(result, Exception):
+            logger.error('[flickrtag]: Unable to fetch photo %s: %s' % (id, result))
+        else:
+            records[id] = photo_record(*result, photo_id=id)
+    return records
+
+
+def fetch_photos(api, photo_ids, concurrency=1, use_async=False,
+                 parts=PHOTO_PARTS):
+    """Fetch the ``parts`` of the cache entries for ``photo_ids``.
+
+    With a ``concurrency`` greater than one the photos are fetched by a
+    bounded pool of worker threads, or by the asyncio client with at most
+    ``concurrency`` requests in flight when ``use_async`` is set and aiohttp
+    is installed. The result is the same as a serial run. Photos that can't
+    be fetched are left out. The photos are fetched with the client in use.
+    """
+    client = api.current_client()
+    if use_async:
+        if aioflickr is not None:
+            logger.info('[flickrtag]: Fetching %d photos with the asyncio client'
+                        % len(photo_ids))
+            return fetch_photos_async(client, photo_ids, concurrency or 1,
+                                      parts)
+        logger.warning('[flickrtag]: FLICKR_TAG_FETCH_ASYNC requires aiohttp, '
+                       'falling back to threads')
+
+    def fetch(photo_id):
+        # In the worker threads too
+        with client:
+            return fetch_photo(api, photo_id, parts)
+
+    workers = min(concurrency or 1, len(photo_ids))
+    if workers <= 1:
+        fetched = map(fetch, photo_ids)
     else:
-        logger.info('[flickrtag]: Found pickled photo mapping')
+        pool = ThreadPool(workers)
+        try:
+            fetched = list(pool.imap_unordered(fetch, photo_ids))
+        finally:
+            pool.close()
+            pool.join()
+    return dict((id, record) for id, record in fetched if record is not None)
+
+
+class LayeredContext(Mapping):
+    """A read-only view of several mappings, looked up in order.
+
+    Used to put the fields of a photo over the site context without copying
+    the whole context for every tag.
+    """
+
+    def __init__(self, *maps):
+        self.maps = maps
+
+    def __getitem__(self, key):
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return any(key in mapping for mapping in self.maps)
+
+    def __iter__(self):
+        return iter(set().union(*self.maps))
+
+    def __len__(self):
+        return len(set().union(*self.maps))
+
+
+def get_template(generator, setting='FLICKR_TAG_TEMPLATE_NAME',
+                 default=default_template):
+    """The template named by ``setting``, or the ``default`` template source,
+    compiled once per process and theme.
+
+    Returns a ``(template, source)`` tuple. The source is None when the
+    template loader can't provide it.
+    """
+    from jinja2 import Template
+
+    template_name = generator.settings[setting]
+    # Sites with other themes have other templates of the same name
+    key = (generator.settings.get('THEME'),
+           tuple(generator.settings.get('THEME_TEMPLATES_OVERRIDES') or ()),
+           setting, template_name)
+    template, source = _templates.get(key, (None, None))
+    if template is not None and template.is_up_to_date:
+        return template, source
 
     # See if a custom template was provided
-    template_name = generator.settings['FLICKR_TAG_TEMPLATE_NAME']
+    template, source = None, default
     if template_name is not None:
         # There's a custom template
         try:
             template = generator.get_template(template_name)
         except Exception:
             logger.error('[flickrtag]: Unable to find the custom template %s' % template_name)
-            template = Template(default_template)
-    else:
-        template = Template(default_template)
+        else:
+            try:
+                source = template.environment.loader.get_source(
+                    template.environment, template.name)[0]
+            except Exception:
+                source = None
+    if template is None:
+        template = Template(default)
+
+    _templates[key] = template, source
+    return template, source
+
+
+def template_fingerprint(generator, template, source, fields=PHOTO_FIELDS):
+    """A hash of what, besides the photo ``fields``, a rendered template
+    depends on.
+
+    That is the template source, the sources of the templates it includes,
+    imports or extends, and the value of every other variable it uses.
+    Returns None when one of them can't be found or serialized, in which
+    case the rendered photos can't be cached between builds.
+    """
+    from jinja2 import meta
+
+    if source is None:
+        return None
+
+    environment = template.environment
+    ast = environment.parse(source)
+    names = meta.find_undeclared_variables(ast)
+    sources = [source]
+    seen = set()
+    pending = list(meta.find_referenced_templates(ast))
+    while pending:
+        name = pending.pop()
+        if name is None:
+            # Picked at render time
+            return None
+        if name in seen:
+            continue
+        seen.add(name)
+        try:
+            referenced = environment.loader.get_source(environment, name)[0]
+        except Exception:
+            return None
+        sources.append(referenced)
+        referenced = environment.parse(referenced)
+        names |= meta.find_undeclared_variables(referenced)
+        pending.extend(meta.find_referenced_templates(referenced))
+
+    variables = LayeredContext(generator.context, template.globals)
+    try:
+        values = json.dumps(
+            dict((name, variables.get(name))
+                 for name in names if name not in fields),
+            sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+    data = '\0'.join(sources) + values
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def fragment_key(fingerprint, record, title, size_alias):
+    """The key of a photo rendered by the template with ``fingerprint``."""
+    data = json.dumps([fingerprint, record, title, size_alias], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def render_template(template, variables):
+    """Render template with a mapping of variables, without copying it."""
+    context = template.new_context(LayeredContext(variables, template.globals),
+                                   shared=True)
+    try:
+        return template.environment.concat(template.root_render_func(context))
+    except Exception:
+        return template.environment.handle_exception()
+
+
+def fragment_keys(generator, template, source, fields, tags):
+    """The fragment cache keys of rendered tags.
+
+    ``tags`` maps each tag to the ``(record, title, size_alias)`` it is
+    rendered from. Returns an empty dict when the template can't be cached.
+    """
+    if not generator.settings['FLICKR_TAG_FRAGMENT_CACHE']:
+        return {}
+    fingerprint = template_fingerprint(generator, template, source, fields)
+    if fingerprint is None:
+        logger.info('[flickrtag]: The template can\'t be cached between builds')
+        return {}
+    return dict((tag, fragment_key(fingerprint, *args))
+                for tag, args in tags.items())
+
+
+def render_fragments(generator, template, tags, keys, fields_for, cache,
+                     stats=None):
+    """Render template for every tag, with the variables ``fields_for(tag)``.
+
+    Tags with a key in ``keys`` are taken from, or added to, the fragment
+    cache. Returns a dict of the HTML by tag.
+    """
+    cached = cache.get_fragments(keys.values())
+    if stats is not None:
+        hits = sum(1 for tag in tags if keys.get(tag) in cached)
+        stats.count('fragment_hits', hits)
+        stats.count('fragment_misses', len(tags) - hits)
+
+    rendered = {}
+    fragments = {}
+    for tag in tags:
+        key = keys.get(tag)
+        if key in cached:
+            rendered[tag] = cached[key]
+            continue
+
+        # Layer the fields over the site context to render with
+        rendered[tag] = render_template(
+            template, LayeredContext(fields_for(tag), generator.context))
+        if key is not None:
+            fragments[key] = rendered[tag]
+
+    cache.update_fragments(fragments)
+    return rendered
+
+
+def render_photos(generator, photo_tags, photo_mapping, size_alias, cache,
+                  stats=None):
+    """Render the photo of every (id, title) in photo_tags.
+
+    Returns a dict of the HTML by (id, title). Photos rendered by an earlier
+    build with the same template, settings and photo information are taken
+    from the cache instead.
+    """
+    template, source = get_template(generator)
+    photo_tags = [tag for tag in photo_tags if tag[0] in photo_mapping]
+
+    keys = fragment_keys(
+        generator, template, source, PHOTO_FIELDS,
+        dict(((id, title), (photo_mapping[id], title, size_alias))
+             for id, title in photo_tags))
+
+    def fields_for(tag):
+        return photo_fields(photo_mapping[tag[0]], tag[1], size_alias)
+
+    return render_fragments(generator, template, photo_tags, keys,
+                            fields_for, cache, stats)
+
+
+def render_grids(generator, group_tags, groups, size_alias, cache,
+                 stats=None):
+    """Render the photos of every (kind, id, title) in group_tags as a grid.
+
+    ``groups`` maps each (kind, id) to the cache entries of its photos.
+    Returns a dict of the HTML by (kind, id, title).
+    """
+    template, source = get_template(generator, 'FLICKR_TAG_GRID_TEMPLATE_NAME',
+                                    default_grid_template)
+    group_tags = [tag for tag in group_tags if tag[:2] in groups]
+
+    keys = fragment_keys(
+        generator, template, source, GRID_FIELDS,
+        dict((tag, (groups[tag[:2]], tag[2], size_alias))
+             for tag in group_tags))
+
+    def fields_for(tag):
+        return {
+            'photos': [photo_fields(record, '', size_alias)
+                       for record in groups[tag[:2]]],
+            'title': tag[2],
+        }
+
+    return render_fragments(generator, template, group_tags, keys,
+                            fields_for, cache, stats)
+
+
+def refresh_cache(api, cache, per_page=500):
+    """Drop the cached photos that changed on Flickr since the last sync.
+
+    Uses flickr.photos.recentlyUpdated, so FLICKR_API_TOKEN must belong to
+    the owner of the photos. The first sync only records its time. When
+    the changes can't be fetched the cache is left as it is, and they are
+    asked for again on the next build.
+    """
+    client = api.current_client()
+    if client.api_token is None:
+        logger.warning('[flickrtag]: FLICKR_TAG_CACHE_REFRESH requires FLICKR_API_TOKEN')
+        return
+
+    now = int(time.time())
+    last_sync = cache.get_meta('last_sync')
+    if last_sync is not None:
+        try:
+            updated = set(str(photo.id) for photo in
+                          api.photos_recentlyUpdated_iter(last_sync,
+                                                          per_page=per_page))
+        except api.REQUEST_ERRORS as e:
+            logger.error('[flickrtag]: Unable to fetch the changed photos: %s' % e)
+            return
+
+        if updated:
+            deleted = cache.delete_photos(updated)
+            logger.info('[flickrtag]: %d cached photos changed on Flickr' % deleted)
+            # The kept responses may still have the old photos
+            if client.responses is not None:
+                client.responses.clear()
+
+    cache.set_meta('last_sync', str(now))
+
+
+def generator_documents(generator):
+    """The documents (articles, pages, drafts, ...) of a generator."""
+    documents = []
+    seen = set()
+    for attribute in DOCUMENT_ATTRIBUTES:
+        for document in getattr(generator, attribute, None) or ():
+            if id(document) not in seen and hasattr(document, '_content'):
+                seen.add(id(document))
+                documents.append(document)
+    return documents
+
+
+def splice_tags(documents, rendered):
+    """Replace the tags in documents with the rendered photos.
+
+    ``rendered`` holds the HTML by (kind, id, title) tag, where kind is ''
+    for single photos and 'set' or 'gallery' for grids.
+    """
+    def splice(match):
+        html = rendered.get((match.group(2) or '', match.group(3),
+                             match.group(4) or ''))
+        if html is None:
+            logger.error('[flickrtag]: Could not find info for a photo!')
+            return match.group(0)
+
+        # Keep the surrounding paragraph
+        start, end = match.span(1)
+        return '%s%s%s' % (match.string[match.start():start], html,
+                           match.string[end:match.end()])
 
-    logger.info('[flickrtag]: Inserting photo information...')
     for document in documents:
-        for match in flickr_regex.findall(document._content):
-            fid, title = match[1:3]
-            if title:
-                fid = '{}-{}'.format(fid, title)
-            if fid not in photo_mapping:
-                logger.error('[flickrtag]: Could not find info for a photo!')
-                continue
+        # A single pass over the document, splicing in every rendered photo
+        document._content = flickr_regex.sub(splice, document._content)
+
 
-            # Create a context to render with
-            context = generator.context.copy()
-            context.update(photo_mapping[fid])
+def replace_build_tags(batches, complete=False):
+    """Replace the tags in several ``(generator, documents)`` batches.
 
-            # Render the template
-            replacement = template.render(context)
+    The photos of all batches are looked up in the cache and fetched from
+    Flickr together, with a single cache commit. The photosets and
+    galleries are listed once each, and their photos added to the cache.
+    Each batch is then rendered with its own generator. When the batches
+    are ``complete``, holding every document of the build, the rendered
+    photos they don't use are dropped from the cache. Returns the number
+    of photo ids found.
+    """
+    if not batches:
+        return 0
+    generator = batches[0][0]
+    api = generator.flickr_api_client
+    if api is None:
+        logger.error('[flickrtag]: Unable to get the Flickr API object')
+        return 0
 
-            document._content = document._content.replace(match[0], replacement)
+    client = getattr(generator, 'flickr_client', None) or api.default_client
 
+    stats = BuildStats()
+    client.stats = stats
+    responses, flights = client.responses, client.flights
+    response_hits = responses.hits if responses is not None else 0
+    coalesced = flights.coalesced if flights is not None else 0
+    try:
+        # The api functions and objects use the client of the site
+        with client:
+            photo_ids_found = _replace_build_tags(batches, api, stats,
+                                                      complete)
+    finally:
+        client.stats = None
+    if responses is not None:
+        stats.count('response_hits', responses.hits - response_hits)
+    if flights is not None:
+        stats.count('coalesced_calls', flights.coalesced - coalesced)
+
+    logger.info('[flickrtag]: Build stats: %s' % stats.summary())
+    report_file = generator.settings['FLICKR_TAG_STATS_FILE']
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(stats.report(), f, indent=2, sort_keys=True)
     return photo_ids_found
 
 
+def _replace_build_tags(batches, api, stats, complete=False):
+    generator = batches[0][0]
+    size_alias = generator.settings['FLICKR_TAG_IMAGE_SIZE']
+    grid_size_alias = generator.settings['FLICKR_TAG_GRID_IMAGE_SIZE']
+
+    with stats.phase('scan'):
+        batch_tags = []
+        for _, documents in batches:
+            photo_tags = set([])
+            group_tags = set([])
+            for document in documents:
+                for _, kind, id, title in flickr_regex.findall(document._content):
+                    if kind:
+                        group_tags.add((kind, id, title))
+                    elif id.isdigit():
+                        photo_tags.add((id, title))
+            batch_tags.append((photo_tags, group_tags))
+        photo_ids = set(id for photo_tags, _ in batch_tags
+                        for id, _ in photo_tags)
+        group_ids = set(tag[:2] for _, group_tags in batch_tags
+                        for tag in group_tags)
+
+    with stats.phase('plan'):
+        # Plan the parts of each photo the templates render
+        photo_parts = dict((id, set()) for id in photo_ids)
+        for (batch_generator, _), (photo_tags, _) in zip(batches, batch_tags):
+            fields = template_fields(batch_generator,
+                                     *get_template(batch_generator))
+            titles = {}
+            for id, title in photo_tags:
+                titles.setdefault(id, []).append(title)
+            for id, id_titles in titles.items():
+                photo_parts[id] |= plan_parts(fields, id_titles, size_alias)
+
+    with stats.phase('cache'):
+        cache = open_cache(generator.settings['FLICKR_TAG_CACHE_BACKEND'],
+                           generator.settings['FLICKR_TAG_CACHE_LOCATION'])
+    try:
+        if generator.settings['FLICKR_TAG_CACHE_REFRESH']:
+            with stats.phase('refresh'):
+                refresh_cache(api, cache)
+
+        # The listing of a photoset or gallery holds all of its photos
+        groups = {}
+        member_mapping = {}
+        with stats.phase('fetch'):
+            for kind, id in group_ids:
+                records = fetch_group(
+                    api, kind, id,
+                    concurrency=generator.settings['FLICKR_TAG_FETCH_CONCURRENCY'])
+                if records is not None:
+                    groups[kind, id] = records
+                    member_mapping.update((record['id'], record)
+                                          for record in records)
+        photo_ids_found = len(photo_ids | set(member_mapping))
+
+        with stats.phase('cache'):
+            cache.update(member_mapping)
+            photo_mapping = dict((id, member_mapping[id]) for id in photo_ids
+                                 if id in member_mapping)
+            cached = cache.get_many(photo_ids - set(photo_mapping))
+            # The parts missing from the cached entries
+            missing = {}
+            for id in photo_ids - set(photo_mapping):
+                record = cached.get(id)
+                if not record_parts(record):
+                    record = {'id': id}
+                photo_mapping[id] = record
+                parts = photo_parts[id] - record_parts(record)
+                if parts:
+                    missing[id] = parts
+        stats.count('photo_hits', len(photo_ids) - len(missing))
+        stats.count('photo_misses', len(missing))
+
+        owners = generator.settings['FLICKR_TAG_BULK_OWNERS']
+        if missing and owners:
+            # The photos earlier builds didn't find in the lists of the same
+            # owners aren't looked for again
+            meta = json.loads(cache.get_meta('not_listed') or '{}')
+            not_listed = set(meta.get('ids', [])) \
+                if meta.get('owners') == list(owners) else set()
+            with stats.phase('fetch'):
+                fetched = prefetch_owner_photos(
+                    api, owners, [id for id in missing if id not in not_listed],
+                    not_listed=not_listed)
+            if complete:
+                # Forget the photos no document shows any more
+                not_listed &= photo_ids
+            cache.set_meta('not_listed', json.dumps(
+                {'owners': list(owners), 'ids': sorted(not_listed)}))
+            photo_mapping.update(fetched)
+            cache.update(fetched)
+            for id in fetched:
+                del missing[id]
+
+        if missing:
+            logger.info('[flickrtag]: Fetching photo information from Flickr...')
+            # Photos missing the same parts are fetched together
+            by_parts = {}
+            for id, parts in missing.items():
+                by_parts.setdefault(tuple(sorted(parts)), []).append(id)
+            for parts, ids in by_parts.items():
+                with stats.phase('fetch'):
+                    fetched = fetch_photos(
+                        api, ids,
+                        concurrency=generator.settings['FLICKR_TAG_FETCH_CONCURRENCY'],
+                        use_async=generator.settings['FLICKR_TAG_FETCH_ASYNC'],
+                        parts=parts)
+                # Add the fetched parts to the cached ones
+                for id in ids:
+                    if id in fetched:
+                        photo_mapping[id] = dict(photo_mapping[id], **fetched[id])
+                    else:
+                        del photo_mapping[id]
+                cache.update(dict((id, photo_mapping[id]) for id in fetched))
+        else:
+            logger.info('[flickrtag]: Found cached photo mapping')
+
+        logger.info('[flickrtag]: Inserting photo information...')
+        for (batch_generator, documents), (photo_tags, group_tags) in \
+                zip(batches, batch_tags):
+            rendered = {}
+            with stats.phase('render'):
+                if photo_tags:
+                    rendered.update(
+                        (('', ) + tag, html) for tag, html in render_photos(
+                            batch_generator, photo_tags, photo_mapping,
+                            size_alias, cache, stats).items())
+                if group_tags:
+                    rendered.update(render_grids(
+                        batch_generator, group_tags, groups, grid_size_alias,
+                        cache, stats))
+            if rendered:
+                with stats.phase('splice'):
+                    splice_tags(documents, rendered)
+        with stats.phase('commit'):
+            cache.commit(prune_fragments=complete)
+    finally:
+        cache.close()
+
+    return photo_ids_found
+
+
+def replace_tags(generator, documents):
+    return replace_build_tags([(generator, documents)])
+
+
+def replace_all_tags(generators):
+    """Replace the tags in the documents of every generator of the build."""
+    logger.info('[flickrtag]: Parsing documents for photo ids...')
+    batches = [(generator, generator_documents(generator))
+               for generator in generators
+               if getattr(generator, 'flickr_api_client', None) is not None]
+    total = replace_build_tags([batch for batch in batches if batch[1]],
+                               complete=True)
+    logger.info('[flickrtag]: Found %d photos ids in %d documents'
+                % (total, sum(len(documents) for _, documents in batches)))
+
+
 def replace_article_tags(generator):
     logger.info('[flickrtag]: Parsing articles for photo ids...')
     total = replace_tags(generator, generator.articles)
@@ -170,5 +1021,8 @@ def register():
     """Plugin registration."""
     signals.generator_init.connect(setup_flickr)
 
-    signals.article_generator_finalized.connect(replace_article_tags)
-    signals.page_generator_finalized.connect(replace_page_tags)
+    if hasattr(signals, 'all_generators_finalized'):
+        signals.all_generators_finalized.connect(replace_all_tags)
+    else:
+        signals.article_generator_finalized.connect(replace_article_tags)
+        signals.page_generator_finalized.connect(replace_page_tags)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Response Cache
+==============
+
+The parsed responses of the read methods of the Flickr API, kept by
+``flickr.FlickrClient.doget`` so that asking again for the same method and
+parameters costs nothing. The most recently used responses are kept in
+memory, and optionally all of them in an SQLite database, for the following
+builds. Each method has its own time to live.
+"""
+import collections
+import pickle
+import re
+import sqlite3
+import threading
+import time
+
+from six.moves.urllib.parse import urlencode
+
+# Seconds the response of each method stays fresh, DEFAULT_TTL for the
+# others. The responses of methods with a TTL of 0 are never kept.
+TTLS = {
+    'flickr.photos.getSizes': 24 * 3600,
+    'flickr.photos.getInfo': 3600,
+    'flickr.photos.getAllContexts': 3600,
+    'flickr.photos.getRecent': 60,
+    'flickr.photos.recentlyUpdated': 0,
+}
+DEFAULT_TTL = 600
+
+# The methods only reading, by the last part of their name. Those of all
+# other methods (add, set, edit, delete, ...) are never kept.
+READ_METHOD = re.compile(r'(get|search|find|lookup)', re.IGNORECASE)
+UNCACHED_PREFIXES = ('flickr.auth.', 'flickr.test.')
+
+
+def is_read_method(method):
+    """Whether the API method only reads."""
+    return not method.startswith(UNCACHED_PREFIXES) and \
+        READ_METHOD.match(method.rsplit('.', 1)[-1]) is not None
+
+
+class ResponseCache(object):
+    """Responses by key, the ``size`` most recently used in memory, and all
+    of them in the SQLite database at ``path`` if given.
+
+    ``ttls`` overrides the TTLS of methods. It is safe to use from several
+    threads.
+    """
+
+    def __init__(self, size=1024, path=None, ttls=None, default_ttl=DEFAULT_TTL):
+        self.size = size
+        self.path = path
+        self.ttls = dict(TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    def ttl(self, method):
+        """Seconds the responses of method are kept, 0 if they aren't."""
+        if not is_read_method(method):
+            return 0
+        return self.ttls.get(method, self.default_ttl)
+
+    def _database(self):
+        # Opened on first use, by whichever thread that is
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            with self._db:
+                self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                 'key TEXT PRIMARY KEY, '
+                                 'method TEXT NOT NULL, '
+                                 'expires REAL NOT NULL, '
+                                 'data BLOB NOT NULL)')
+                self._db.execute('DELETE FROM responses WHERE expires <= ?',
+                                 (time.time(), ))
+        return self._db
+
+    def _remember(self, key, expires, data):
+        self._entries[key] = (expires, data)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """The fresh response kept for key, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # Most recently used last
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            if self.path is not None:
+                row = self._database().execute(
+                    'SELECT expires, data FROM responses '
+                    'WHERE key = ? AND expires > ?', (key, now)).fetchone()
+                if row is not None:
+                    data = pickle.loads(bytes(row[1]))
+                    self._remember(key, row[0], data)
+                    self.hits += 1
+                    return data
+            self.misses += 1
+            return None
+
+    def set(self, key, method, data):
+        """Keep data, the response of method, for key."""
+        ttl = self.ttl(method)
+        if ttl <= 0:
+            return
+        expires = time.time() + ttl
+        with self._lock:
+            self._remember(key, expires, data)
+            if self.path is not None:
+                db = self._database()
+                with db:
+                    db.execute('INSERT OR REPLACE INTO responses '
+                               '(key, method, expires, data) '
+                               'VALUES (?, ?, ?, ?)',
+                               (key, method, expires, sqlite3.Binary(
+                                   pickle.dumps(data, pickle.HIGHEST_PROTOCOL))))
+
+    def discard(self, name, value):
+        """Forget the responses to requests with the parameter name=value."""
+        param = '&%s&' % urlencode([(name, value)])
+        with self._lock:
+            for key in [key for key in self._entries if param in key + '&']:
+                del self._entries[key]
+            if self.path is not None:
+                db = self._database()
+                with db:
+                    db.execute("DELETE FROM responses "
+                               "WHERE instr(key || '&', ?) > 0", (param, ))
+
+    def clear(self):
+        """Forget every response."""
+        with self._lock:
+            self._entries.clear()
+            if self.path is not None:
+                db = self._database()
+                with db:
+                    db.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Build Statistics
+================
+
+Where the time of a build went: the wall time of each phase of replacing the
+tags, the count, errors and latency of the calls to each API method, the
+bytes received from Flickr and the cache hits and misses.
+"""
+import contextlib
+import math
+import threading
+import time
+
+
+def percentile(values, percent):
+    """The nearest-rank ``percent`` percentile of sorted ``values``."""
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class BuildStats(object):
+    """Timings and counters of a build.
+
+    Set as the ``stats`` of a ``flickr.FlickrClient`` (or ``flickr.stats``)
+    it is told about every API request of the client, from any thread.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.phase_order = []
+        self.latencies = {}
+        self.errors = {}
+        self.bytes = 0
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Add the time spent in the ``with`` block to phase ``name``."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            if name not in self.phases:
+                self.phases[name] = 0.0
+                self.phase_order.append(name)
+            self.phases[name] += time.time() - start
+
+    def record_call(self, method, seconds, size, ok=True):
+        """Record a request to the API ``method``."""
+        with self._lock:
+            self.latencies.setdefault(method, []).append(seconds)
+            if not ok:
+                self.errors[method] = self.errors.get(method, 0) + 1
+            self.bytes += size
+
+    def count(self, name, number=1):
+        """Add ``number`` to the counter ``name``."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + number
+
+    def report(self):
+        """The statistics as a dict, fit for JSON."""
+        calls = {}
+        for method, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            calls[method] = {
+                'count': len(latencies),
+                'errors': self.errors.get(method, 0),
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'max': latencies[-1],
+            }
+        return {
+            'phases': dict(self.phases),
+            'calls': calls,
+            'bytes': self.bytes,
+            'counters': dict(self.counters),
+        }
+
+    def summary(self):
+        """The statistics on a single line."""
+        report = self.report()
+        parts = [', '.join('%s %.3fs' % (name, self.phases[name])
+                           for name in self.phase_order)]
+        if report['calls']:
+            parts.append('%d API calls, %.1f KiB: %s' % (
+                sum(call['count'] for call in report['calls'].values()),
+                self.bytes / 1024.0,
+                ', '.join('%s %d (%d errors) p50 %.0fms p90 %.0fms p99 %.0fms'
+                          % (method.replace('flickr.', '', 1), call['count'],
+                             call['errors'], call['p50'] * 1000,
+                             call['p90'] * 1000, call['p99'] * 1000)
+                          for method, call in sorted(report['calls'].items()))))
+        if self.counters:
+            parts.append(', '.join('%s %d' % item
+                                   for item in sorted(self.counters.items())))
+        return '; '.join(part for part in parts if part)
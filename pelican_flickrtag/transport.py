@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP Transport
+==============
+
+Keep-alive HTTP(S) connections pooled per host, used by ``_doget`` and
+``_dopost`` in :mod:`pelican_flickrtag.flickr` instead of a fresh ``urlopen``
+(and TCP+TLS handshake) for every API call. Responses are requested gzip
+compressed and decoded as a stream.
+
+``Throttle`` keeps the API calls under a rate limit, adapts the number of
+calls in flight to how Flickr copes with them, and retries transient
+failures with a jittered exponential backoff. ``SingleFlight`` makes
+identical calls made at the same time share a single request.
+"""
+import io
+import logging
+import random
+import socket
+import threading
+import time
+import zlib
+
+from six.moves import http_client
+from six.moves.urllib.error import HTTPError, URLError
+from six.moves.urllib.parse import urljoin, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# time.monotonic is missing on Python 2
+monotonic = getattr(time, 'monotonic', time.time)
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+CHUNK_SIZE = 16 * 1024
+
+# Errors that mean a kept-alive connection was closed by the server
+# while idle. The request is retried once on a fresh connection.
+STALE_CONNECTION_ERRORS = (http_client.BadStatusLine, http_client.CannotSendRequest,
+                           http_client.ResponseNotReady, socket.error)
+
+
+class Response(object):
+    """A streamed, decoded HTTP response.
+
+    ``read`` returns the decompressed body. The connection goes back to its
+    pool once the body has been read to the end, or is dropped when the
+    response is closed early. ``bytes_read`` counts the body bytes received,
+    before decompression.
+    """
+
+    def __init__(self, pool, key, conn, response):
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self._buffer = b''
+        self._eof = False
+        self.bytes_read = 0
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding in ('gzip', 'x-gzip'):
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = None
+
+    def _fill(self, size):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._response.read(CHUNK_SIZE)
+            self.bytes_read += len(chunk)
+            if not chunk:
+                self._eof = True
+                if self._decoder is not None:
+                    self._buffer += self._decoder.flush()
+                self._release()
+            elif self._decoder is not None:
+                self._buffer += self._decoder.decompress(chunk)
+            else:
+                self._buffer += chunk
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self._fill(size)
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _release(self):
+        if self._conn is None:
+            return
+        if self._response.will_close:
+            self._conn.close()
+        else:
+            self._pool._put(self._key, self._conn)
+        self._conn = None
+
+    def close(self):
+        if self._conn is not None:
+            # The body was not read to the end, so the connection can't be
+            # reused.
+            self._conn.close()
+            self._conn = None
+        self._eof = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool(object):
+    """Idle keep-alive connections, kept per (scheme, host, port).
+
+    At most ``maxsize`` idle connections are kept for each host; more may be
+    open at the same time when several threads make requests.
+    """
+
+    def __init__(self, maxsize=10):
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return None
+
+    def _put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _connect(self, key, connect_timeout, read_timeout):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http_client.HTTPSConnection(host, port, timeout=connect_timeout)
+        else:
+            conn = http_client.HTTPConnection(host, port, timeout=connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(read_timeout)
+        return conn
+
+    def _send(self, conn, method, path, body, headers):
+        conn.request(method, path, body, headers)
+        return conn.getresponse()
+
+    def urlopen(self, url, data=None, connect_timeout=None, read_timeout=None):
+        """Open url on a pooled connection and return a streamed Response.
+
+        Like ``urlopen``, the request is a POST when ``data`` is given,
+        redirects are followed and an ``HTTPError`` is raised for error
+        statuses.
+        """
+        if data is not None and not isinstance(data, bytes):
+            data = data.encode('utf-8')
+
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+
+            headers = {'Accept-Encoding': 'gzip'}
+            if data is not None:
+                method = 'POST'
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            else:
+                method = 'GET'
+
+            conn = self._get(key)
+            try:
+                if conn is not None:
+                    try:
+                        response = self._send(conn, method, path, data, headers)
+                    except STALE_CONNECTION_ERRORS as e:
+                        if isinstance(e, socket.timeout):
+                            raise
+                        conn.close()
+                        conn = None
+                if conn is None:
+                    conn = self._connect(key, connect_timeout, read_timeout)
+                    response = self._send(conn, method, path, data, headers)
+            except (socket.error, http_client.HTTPException) as e:
+                if conn is not None:
+                    conn.close()
+                raise URLError(e)
+
+            response = Response(self, key, conn, response)
+            if response.status in REDIRECT_CODES and response.headers.get('Location'):
+                response.read()
+                url = urljoin(url, response.headers.get('Location'))
+                if response.status == 303:
+                    data = None
+                continue
+            if response.status >= 400:
+                body = response.read()
+                raise HTTPError(url, response.status, response.reason,
+                                response.headers, io.BytesIO(body))
+            return response
+
+        raise URLError('Too many redirects for %s' % url)
+
+
+class TokenBucket(object):
+    """Allow ``rate`` requests per second on average, in bursts of up to
+    ``burst`` requests."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token, and return the seconds to wait before it may be
+        used."""
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class AdaptiveLimit(object):
+    """Limit the number of requests in flight, from one to ``maximum``.
+
+    The limit grows by one for every limit's worth of requests answered
+    without their latency growing past ``tolerance`` times the average, and
+    is halved on a failure or latency spike (at most once per round trip).
+    """
+
+    def __init__(self, maximum, tolerance=2.0):
+        self.maximum = max(1, maximum)
+        self.limit = float(self.maximum)
+        self.tolerance = tolerance
+        self._in_flight = 0
+        self._latency = None
+        self._decreased = monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Block until a request may be sent, and return when it was."""
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+        return monotonic()
+
+    def try_acquire(self):
+        """Like ``acquire``, but return None at once if no request may be
+        sent now."""
+        with self._cond:
+            if self._in_flight >= int(self.limit):
+                return None
+            self._in_flight += 1
+        return monotonic()
+
+    def release(self, started, ok=True):
+        """Record the outcome of a request sent at ``started``."""
+        now = monotonic()
+        latency = now - started
+        with self._cond:
+            self._in_flight -= 1
+            spike = self._latency is not None and \
+                latency > self.tolerance * self._latency
+            if not ok or spike:
+                # Only requests sent after the last decrease saw its effect
+                if started >= self._decreased:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._decreased = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            if ok:
+                self._latency = latency if self._latency is None else \
+                    0.9 * self._latency + 0.1 * latency
+            self._cond.notify_all()
+
+
+class Throttle(object):
+    """Rate limiting, adaptive concurrency and retries for API calls.
+
+    ``rate`` is the number of calls per second allowed on average, with
+    bursts of ``burst`` calls; None means no limit. ``concurrency`` is the
+    most calls in flight at once (see ``AdaptiveLimit``); None means no
+    limit. Failed calls are retried up to ``retries`` times, after a random
+    delay of up to ``backoff`` seconds doubled on each attempt, up to
+    ``max_backoff`` seconds.
+    """
+
+    def __init__(self, rate=None, burst=10, concurrency=None, retries=3,
+                 backoff=0.5, max_backoff=30):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limit = AdaptiveLimit(concurrency) if concurrency else None
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def wait(self):
+        """Take a call from the rate limit, and return the seconds to wait
+        before making it."""
+        if self.bucket is None:
+            return 0
+        return self.bucket.reserve()
+
+    def retry_delay(self, attempt, error):
+        """The seconds to wait before retrying a call that failed ``attempt``
+        times before, the last time with ``error``. None if it has been
+        retried enough."""
+        if attempt >= self.retries:
+            return None
+        # Full jitter, so calls failed together don't retry together
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** attempt))
+        headers = getattr(error, 'hdrs', None)
+        if headers is not None:
+            try:
+                retry_after = float(headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                pass
+            else:
+                delay = max(delay, min(retry_after, self.max_backoff))
+        return delay
+
+    def call(self, func, is_transient, retry=True):
+        """Return ``func()``, retrying it while it raises errors for which
+        ``is_transient(error)`` is true, unless ``retry`` is false."""
+        attempt = 0
+        while True:
+            delay = self.wait()
+            if delay > 0:
+                time.sleep(delay)
+            started = self.limit.acquire() if self.limit is not None else None
+            try:
+                result = func()
+            except Exception as e:
+                transient = is_transient(e)
+                if self.limit is not None:
+                    self.limit.release(started, ok=not transient)
+                delay = self.retry_delay(attempt, e) \
+                    if transient and retry else None
+                if delay is None:
+                    raise
+                logger.warning('[flickrtag]: %s, retrying in %.1f seconds'
+                               % (e, delay))
+                time.sleep(delay)
+                attempt += 1
+            else:
+                if self.limit is not None:
+                    self.limit.release(started)
+                return result
+
+
+class _Flight(object):
+    """A call in flight, and its outcome once it landed."""
+
+    def __init__(self):
+        self.landed = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Lets concurrent identical calls share a single call.
+
+    While a call for a key is in flight, the calls for the same key wait for
+    it and get its result (or error) instead of being made again.
+    ``coalesced`` counts the calls saved that way.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func):
+        """Return ``func()``, or the result of the call in flight for key."""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.landed.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.landed.set()
+        return flight.result
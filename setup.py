@@ -42,6 +42,9 @@ setup(
     package_dir={'pelican_flickrtag': 'pelican_flickrtag'},
     include_package_data=True,
     install_requires=requires,
+    extras_require={
+        'async': ['aiohttp'],
+    },
     license='MIT',
     classifiers=[
         'Operating System :: OS Independent',
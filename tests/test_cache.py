@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the photo cache backends.
+"""
+import pickle
+
+import pytest
+
+from pelican_flickrtag.cache import PickleCache, SQLiteCache, open_cache
+
+RECORD = {'id': '123', 'title': 'A title', 'sizes': [
+    {'label': 'Medium', 'width': 500, 'height': 333,
+     'source': 'https://live.staticflickr.com/65535/123_abc.jpg',
+     'url': 'https://www.flickr.com/photos/someone/123/sizes/m/'}]}
+
+
+@pytest.fixture(params=['pickle', 'sqlite'])
+def reopen(request, tmpdir):
+    """A function opening the cache of a backend, again after each commit."""
+    location = str(tmpdir.join('flickr.cache'))
+    caches = []
+
+    def reopen():
+        if caches:
+            caches[-1].close()
+        caches.append(open_cache(request.param, location))
+        return caches[-1]
+    yield reopen
+    caches[-1].close()
+
+
+def test_entries(reopen):
+    cache = reopen()
+    assert cache.get_many(['123']) == {}
+    cache.update({'123': RECORD, '456': {'id': '456'}})
+    cache.commit()
+
+    cache = reopen()
+    assert cache.get_many(['123', '789']) == {'123': RECORD}
+    assert cache.delete_photos(['456']) == 1
+    cache.commit()
+
+    assert reopen().get_many(['123', '456']) == {'123': RECORD}
+
+
+def test_delete_legacy_keys(reopen):
+    cache = reopen()
+    cache.update({'123-A title': RECORD, '1234-Other': RECORD})
+    assert cache.delete_photos(['123']) == 1
+    assert cache.get_many(['123-A title', '1234-Other']) == {
+        '1234-Other': RECORD}
+
+
+def test_meta(reopen):
+    cache = reopen()
+    assert cache.get_meta('last_sync') is None
+    cache.set_meta('last_sync', '1600000000')
+    cache.commit()
+    assert reopen().get_meta('last_sync') == '1600000000'
+
+
+def test_fragments(reopen):
+    cache = reopen()
+    cache.update_fragments({'a': '<p>a</p>', 'b': '<p>b</p>'})
+    cache.commit()
+
+    cache = reopen()
+    assert cache.get_fragments(['a', 'c']) == {'a': '<p>a</p>'}
+    cache.commit()
+
+    cache = reopen()
+    assert cache.get_fragments(['a', 'b']) == {'a': '<p>a</p>',
+                                               'b': '<p>b</p>'}
+
+
+def test_prune_fragments(reopen):
+    cache = reopen()
+    cache.update_fragments({'a': '<p>a</p>', 'b': '<p>b</p>'})
+    cache.commit()
+
+    cache = reopen()
+    cache.get_fragments(['a'])
+    cache.update_fragments({'c': '<p>c</p>'})
+    cache.commit(prune_fragments=True)
+
+    cache = reopen()
+    assert cache.get_fragments(['a', 'b', 'c']) == {'a': '<p>a</p>',
+                                                    'c': '<p>c</p>'}
+
+
+def test_prune_nothing_used(reopen):
+    # A build without any photo doesn't empty the cache
+    cache = reopen()
+    cache.update_fragments({'a': '<p>a</p>'})
+    cache.commit()
+
+    reopen().commit(prune_fragments=True)
+    assert reopen().get_fragments(['a']) == {'a': '<p>a</p>'}
+
+
+def test_pickle_keeps_meta_apart(tmpdir):
+    path = str(tmpdir.join('flickr.cache'))
+    cache = PickleCache(path)
+    cache.update({'123': RECORD})
+    cache.set_meta('last_sync', '1')
+    cache.update_fragments({'a': '<p>a</p>'})
+    cache.commit()
+
+    cache = PickleCache(path)
+    assert list(cache._mapping) == ['123']
+
+
+def test_sqlite_migrates_pickle(tmpdir):
+    legacy_path = str(tmpdir.join('flickr.cache'))
+    with open(legacy_path, 'wb') as f:
+        pickle.dump({'123-A title': RECORD, '456': {'id': '456'}}, f)
+
+    cache = SQLiteCache(legacy_path + '.sqlite3', legacy_path=legacy_path)
+    assert cache.get_many(['123-A title', '456']) == {
+        '123-A title': RECORD, '456': {'id': '456'}}
+    assert cache.get_meta('migrated') == legacy_path
+    cache.delete_photos(['456'])
+    cache.commit()
+    cache.close()
+
+    # Only imported once, so deleted entries stay deleted
+    cache = SQLiteCache(legacy_path + '.sqlite3', legacy_path=legacy_path)
+    assert cache.get_many(['123-A title', '456']) == {'123-A title': RECORD}
+    cache.close()
+
+
+def test_sqlite_without_pickle(tmpdir):
+    legacy_path = str(tmpdir.join('flickr.cache'))
+    cache = SQLiteCache(legacy_path + '.sqlite3', legacy_path=legacy_path)
+    assert cache.get_meta('migrated') is None
+    cache.close()
+
+
+def test_sqlite_batches(tmpdir, monkeypatch):
+    monkeypatch.setattr('pelican_flickrtag.cache.SQLITE_BATCH_SIZE', 3)
+    cache = SQLiteCache(str(tmpdir.join('flickr.sqlite3')))
+    ids = [str(i) for i in range(10)]
+    cache.update(dict((photo_id, {'id': photo_id}) for photo_id in ids))
+    assert len(cache.get_many(ids + ['10'])) == 10
+    assert cache.delete_photos(ids[:7]) == 7
+    assert sorted(cache.get_many(ids)) == ids[7:]
+    cache.close()
+
+
+def test_unknown_backend(tmpdir):
+    with pytest.raises(ValueError):
+        open_cache('memcached', str(tmpdir.join('flickr.cache')))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the response parsers and the response cache of the Flickr client.
+
+    $ python -m pytest tests
+"""
+import json
+from xml.dom import minidom
+
+import pytest
+
+from pelican_flickrtag import flickr
+from pelican_flickrtag.responses import ResponseCache
+
+INFO_XML = """<?xml version="1.0" encoding="utf-8" ?>
+<rsp stat="ok">
+<photo id="123" secret="abc" server="65535" farm="66" isfavorite="0"
+    license="0" rotation="0">
+    <owner nsid="12345678@N00" username="someone" realname="Some One"
+        location="" />
+    <title>A title &amp; more</title>
+    <description>A description</description>
+    <visibility ispublic="1" isfriend="0" isfamily="0" />
+    <dates posted="1600000000" taken="2020-09-13 12:26:40"
+        takengranularity="0" />
+    <editability cancomment="0" canaddmeta="0" />
+    <comments>2</comments>
+    <tags />
+    <urls>
+        <url type="photopage">https://www.flickr.com/photos/someone/123/</url>
+    </urls>
+</photo>
+</rsp>"""
+
+INFO_JSON = json.dumps({
+    'photo': {
+        'id': '123', 'secret': 'abc', 'server': '65535', 'farm': 66,
+        'isfavorite': 0, 'license': '0', 'rotation': 0,
+        'owner': {'nsid': '12345678@N00', 'username': 'someone',
+                  'realname': 'Some One', 'location': ''},
+        'title': {'_content': 'A title & more'},
+        'description': {'_content': 'A description'},
+        'visibility': {'ispublic': 1, 'isfriend': 0, 'isfamily': 0},
+        'dates': {'posted': '1600000000', 'taken': '2020-09-13 12:26:40',
+                  'takengranularity': 0},
+        'editability': {'cancomment': 0, 'canaddmeta': 0},
+        'comments': {'_content': 2},
+        'tags': {'tag': []},
+        'urls': {'url': [{
+            'type': 'photopage',
+            '_content': 'https://www.flickr.com/photos/someone/123/'}]},
+    },
+    'stat': 'ok',
+})
+
+SIZES_XML = """<rsp stat="ok">
+<sizes canblog="0" canprint="0" candownload="1">
+    <size label="Square" width="75" height="75"
+        source="https://live.staticflickr.com/65535/123_abc_s.jpg"
+        url="https://www.flickr.com/photos/someone/123/sizes/sq/"
+        media="photo" />
+    <size label="Medium" width="500" height="333"
+        source="https://live.staticflickr.com/65535/123_abc.jpg"
+        url="https://www.flickr.com/photos/someone/123/sizes/m/"
+        media="photo" />
+</sizes>
+</rsp>"""
+
+SIZES_JSON = json.dumps({
+    'sizes': {'canblog': 0, 'canprint': 0, 'candownload': 1, 'size': [
+        {'label': 'Square', 'width': 75, 'height': 75,
+         'source': 'https://live.staticflickr.com/65535/123_abc_s.jpg',
+         'url': 'https://www.flickr.com/photos/someone/123/sizes/sq/',
+         'media': 'photo'},
+        {'label': 'Medium', 'width': 500, 'height': '333',
+         'source': 'https://live.staticflickr.com/65535/123_abc.jpg',
+         'url': 'https://www.flickr.com/photos/someone/123/sizes/m/',
+         'media': 'photo'},
+    ]},
+    'stat': 'ok',
+})
+
+ERROR_XML = '<rsp stat="fail"><err code="1" msg="Photo not found" /></rsp>'
+
+ERROR_JSON = json.dumps({'stat': 'fail', 'code': 1,
+                         'message': 'Photo not found'})
+
+
+def as_dict(bag):
+    """The attributes of a parsed response, recursively."""
+    if isinstance(bag, list):
+        return [as_dict(item) for item in bag]
+    if isinstance(bag, flickr.Bag):
+        return dict((key, as_dict(value)) for key, value in vars(bag).items())
+    return bag
+
+
+def test_parse_matches_unmarshal():
+    for source in (INFO_XML, SIZES_XML, ERROR_XML):
+        expected = flickr.unmarshal(minidom.parseString(source))
+        assert as_dict(flickr.parse(source)) == as_dict(expected)
+
+
+@pytest.mark.parametrize('xml_source, json_source', [
+    (INFO_XML, INFO_JSON),
+    (SIZES_XML, SIZES_JSON),
+])
+def test_parse_json_matches_xml(xml_source, json_source):
+    xml_data = flickr.parse(xml_source)
+    json_data = flickr.parse_json(json_source)
+    assert as_dict(json_data) == as_dict(xml_data)
+    assert flickr._get_data(json_data).rsp.stat == 'ok'
+
+
+def test_json_photo_and_sizes():
+    photo = flickr.Photo('123')
+    photo._set_properties(flickr.parse_json(INFO_JSON).rsp.photo)
+    assert photo.title == 'A title & more'
+    assert photo.farm == '66'
+    assert photo.url == 'https://www.flickr.com/photos/someone/123/'
+
+    sizes = flickr._parse_sizes(flickr.parse_json(SIZES_JSON).rsp.sizes)
+    assert sizes == flickr._parse_sizes(flickr.parse(SIZES_XML).rsp.sizes)
+
+
+@pytest.mark.parametrize('source, parse', [
+    (ERROR_XML, flickr.parse),
+    (ERROR_JSON, flickr.parse_json),
+])
+def test_errors(source, parse):
+    with pytest.raises(flickr.FlickrError) as error:
+        flickr._get_data(parse(source))
+    assert 'Photo not found' in str(error.value)
+
+
+@pytest.mark.parametrize('source, parse', [
+    (INFO_XML[:200], flickr.parse),
+    (INFO_JSON[:200], flickr.parse_json),
+])
+def test_truncated_responses_are_request_errors(source, parse):
+    with pytest.raises(flickr.REQUEST_ERRORS):
+        parse(source)
+
+
+@pytest.fixture(params=[False, True], ids=['memory', 'sqlite'])
+def responses(request, tmpdir):
+    path = str(tmpdir.join('responses.sqlite3')) if request.param else None
+    cache = ResponseCache(size=10, path=path)
+    yield cache
+    cache.close()
+
+
+def test_responses_discard(responses):
+    info = 'https://api/?method=flickr.photos.getInfo&photo_id=%s'
+    responses.set(info % '1', 'flickr.photos.getInfo', 'one')
+    responses.set(info % '12', 'flickr.photos.getInfo', 'twelve')
+    responses.set(info % '1' + '&secret=x', 'flickr.photos.getInfo', 'other')
+
+    responses.discard('photo_id', '1')
+    assert responses.get(info % '1') is None
+    assert responses.get(info % '1' + '&secret=x') is None
+    assert responses.get(info % '12') == 'twelve'
+    if responses.path is not None:
+        # Forgotten in the database too
+        responses._entries.clear()
+        assert responses.get(info % '1') is None
+        assert responses.get(info % '12') == 'twelve'
+
+
+def test_writes_forget_responses():
+    responses = ResponseCache()
+    client = flickr.FlickrClient(api_key='key', responses=responses)
+    key = client.response_key('flickr.photos.getInfo', False,
+                              {'photo_id': '123'})
+    responses.set(key, 'flickr.photos.getInfo', 'info')
+    client.forget_responses({'photo_id': '123', 'title': 'New title'})
+    assert responses.get(key) is None
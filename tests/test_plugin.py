@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the plugin: what it fetches, how it renders and caches photos, and
+how it replaces the tags.
+"""
+import copy
+
+from jinja2 import DictLoader, Environment
+
+from pelican_flickrtag import flickr, plugin
+
+SIZES = [
+    {'label': 'Square', 'width': 75, 'height': 75,
+     'source': 'https://live.staticflickr.com/65535/123_abc_s.jpg',
+     'url': 'https://www.flickr.com/photos/someone/123/sizes/sq/'},
+    {'label': 'Medium', 'width': 500, 'height': 333,
+     'source': 'https://live.staticflickr.com/65535/123_abc.jpg',
+     'url': 'https://www.flickr.com/photos/someone/123/sizes/m/'},
+    {'label': 'Large', 'width': 1024, 'height': 683,
+     'source': 'https://live.staticflickr.com/65535/123_def_b.jpg',
+     'url': 'https://www.flickr.com/photos/someone/123/sizes/l/'},
+]
+
+INFO = {'id': '123', 'title': 'A title',
+        'url': 'https://www.flickr.com/photos/someone/123/',
+        'farm': '66', 'server': '65535', 'secret': 'abc'}
+
+
+class Generator(object):
+    """The parts of a Pelican generator the plugin uses."""
+
+    def __init__(self, context=None, templates=None, **settings):
+        self.settings = {'FLICKR_TAG_FRAGMENT_CACHE': True}
+        self.settings.update(settings)
+        self.context = dict(context or {})
+        self.env = Environment(loader=DictLoader(templates or {}))
+
+
+class Document(object):
+
+    def __init__(self, content):
+        self._content = content
+
+
+def compile_template(generator, source):
+    return generator.env.from_string(source), source
+
+
+def test_size_for_alias():
+    assert plugin.size_for_alias(SIZES, 'Large')['label'] == 'Large'
+    assert plugin.size_for_alias(SIZES, 'Original')['label'] == 'Medium'
+    # Photos smaller than Medium don't have it
+    assert plugin.size_for_alias(SIZES[:1], 'Medium')['label'] == 'Square'
+    assert plugin.size_for_alias([], 'Medium') is None
+
+
+def test_url_for_alias():
+    record = dict(INFO, sizes=SIZES)
+    assert plugin.url_for_alias(record, 'Large') == \
+        '//live.staticflickr.com/65535/123_def_b.jpg'
+    # Whichever parts of the photo were fetched
+    for alias in ('Square', 'Medium'):
+        with_sizes = plugin.url_for_alias({'id': '123', 'sizes': SIZES}, alias)
+        assert with_sizes == plugin.url_for_alias(INFO, alias)
+        assert with_sizes == plugin.url_for_alias(record, alias)
+    # Larger sizes have their own secret
+    assert plugin.url_for_alias(INFO, 'Original') is None
+    assert plugin.url_for_alias({'id': '123'}, 'Medium') is None
+
+
+def test_photo_fields():
+    fields = plugin.photo_fields({'id': '123', 'sizes': SIZES}, None, 'Medium')
+    assert fields == {'id': '123', 'title': None,
+                      'raw_url': '//live.staticflickr.com/65535/123_abc.jpg',
+                      'url': INFO['url'],
+                      'width': 500, 'height': 333}
+    fields = plugin.photo_fields(INFO, 'Own title', 'Medium 640')
+    assert fields == {'id': '123', 'title': 'Own title',
+                      'raw_url': '//live.staticflickr.com/65535/123_abc_z.jpg',
+                      'url': INFO['url']}
+
+
+def test_record_parts():
+    assert plugin.record_parts(dict(INFO, sizes=SIZES)) == {'info', 'sizes'}
+    assert plugin.record_parts({'id': '123', 'sizes': SIZES}) == {'sizes'}
+    assert plugin.record_parts(INFO) == {'info'}
+    # Entries of older versions
+    assert plugin.record_parts({'title': 'A title', 'raw_url': ''}) == set()
+
+
+def test_template_fields():
+    generator = Generator()
+    template, source = compile_template(generator, plugin.default_template)
+    assert plugin.template_fields(generator, template, source) == \
+        {'url', 'raw_url', 'title'}
+
+    generator.context['FLICKR_TAG_INCLUDE_DIMENSIONS'] = True
+    assert plugin.template_fields(generator, template, source) == \
+        {'url', 'raw_url', 'title', 'width', 'height'}
+
+    template, source = compile_template(
+        generator, '{% set url = "x" %}{{ url }}{{ id }}')
+    assert plugin.template_fields(generator, template, source) == {'id'}
+
+
+def test_template_fields_unknown():
+    generator = Generator(templates={'other.html': '{{ width }}'})
+    template, source = compile_template(
+        generator, '{% include "other.html" %}{{ id }}')
+    assert plugin.template_fields(generator, template, source) == \
+        set(plugin.PHOTO_FIELDS)
+    assert plugin.template_fields(generator, template, None) == \
+        set(plugin.PHOTO_FIELDS)
+
+
+def test_plan_parts():
+    everything = set(plugin.PHOTO_FIELDS)
+    assert plugin.plan_parts(everything, [None], 'Medium') == \
+        {'info', 'sizes'}
+    assert plugin.plan_parts(everything, ['A title'], 'Medium') == {'sizes'}
+    assert plugin.plan_parts({'raw_url', 'url', 'title'}, [None, 'A title'],
+                             'Medium') == {'info'}
+    assert plugin.plan_parts({'raw_url', 'url', 'title'}, ['A title'],
+                             'Medium') == {'sizes'}
+    # Larger sizes have their own secret
+    assert plugin.plan_parts({'raw_url', 'title'}, [None], 'Original') == \
+        {'info', 'sizes'}
+    assert plugin.plan_parts({'id'}, [None], 'Medium') == set()
+
+
+def fingerprint(generator, source):
+    template, source = compile_template(generator, source)
+    return plugin.template_fingerprint(generator, template, source)
+
+
+def test_fingerprint_settings():
+    generator = Generator(context={'SITEURL': 'https://example.com'})
+    source = '<a href="{{ SITEURL }}/{{ id }}">{{ title }}</a>'
+    before = fingerprint(generator, source)
+    assert before is not None
+    assert fingerprint(generator, source) == before
+    # Photo fields change with the photo, not the template
+    generator.context['title'] = 'Site title'
+    assert fingerprint(generator, source) == before
+
+    generator.context['SITEURL'] = 'https://example.org'
+    assert fingerprint(generator, source) != before
+    assert fingerprint(generator, source + ' ') != before
+
+
+def test_fingerprint_referenced_templates():
+    templates = {'photo.html': '<img src="{{ raw_url }}">'}
+    generator = Generator(templates=templates)
+    source = '<p>{% include "photo.html" %}</p>'
+    before = fingerprint(generator, source)
+    assert before is not None
+
+    templates['photo.html'] = '<img src="{{ raw_url }}" alt="">'
+    assert fingerprint(generator, source) != before
+
+    # Variables of the included template count too
+    templates['photo.html'] = '<img src="{{ SITEURL }}{{ raw_url }}">'
+    before = fingerprint(generator, source)
+    generator.context['SITEURL'] = 'https://example.com'
+    assert fingerprint(generator, source) != before
+
+
+def test_fingerprint_uncacheable():
+    generator = Generator(context={'SETTING': object()})
+    assert fingerprint(generator, '{{ SETTING }}') is None
+    assert fingerprint(generator, '{% include "missing.html" %}') is None
+    assert fingerprint(generator, '{% include name %}') is None
+    template, _ = compile_template(generator, '{{ id }}')
+    assert plugin.template_fingerprint(generator, template, None) is None
+
+
+def test_fragment_keys():
+    generator = Generator()
+    template, source = compile_template(generator, plugin.default_template)
+    record = dict(INFO, sizes=SIZES)
+    changed = dict(record, title='New title')
+    tags = {
+        ('', '123', ''): (record, None, 'Medium'),
+        ('', '123', 'Own title'): (record, 'Own title', 'Medium'),
+        ('', '124', ''): (changed, None, 'Medium'),
+    }
+    keys = plugin.fragment_keys(generator, template, source,
+                                plugin.PHOTO_FIELDS, tags)
+    assert len(set(keys.values())) == 3
+    assert keys == plugin.fragment_keys(generator, template, source,
+                                        plugin.PHOTO_FIELDS,
+                                        copy.deepcopy(tags))
+
+    generator.context['FLICKR_TAG_INCLUDE_DIMENSIONS'] = True
+    assert not set(keys.values()) & set(plugin.fragment_keys(
+        generator, template, source, plugin.PHOTO_FIELDS, tags).values())
+
+    generator.settings['FLICKR_TAG_FRAGMENT_CACHE'] = False
+    assert plugin.fragment_keys(generator, template, source,
+                                plugin.PHOTO_FIELDS, tags) == {}
+
+
+def test_splice_tags():
+    documents = [
+        Document('<p>[flickr:id=123]</p>\n<p>Text</p>\n'
+                 '<p>[flickr:id=123,title=Own title]</p>'),
+        Document('<p>[flickrset:id=72157]</p><p>[flickr:id=999]</p>'),
+        Document('<p>No photos</p>'),
+    ]
+    plugin.splice_tags(documents, {
+        ('', '123', ''): '<img a>',
+        ('', '123', 'Own title'): '<img b>',
+        ('set', '72157', ''): '<div grid>',
+    })
+    assert documents[0]._content == \
+        '<p><img a></p>\n<p>Text</p>\n<p><img b></p>'
+    # Tags without a rendered photo are left in place
+    assert documents[1]._content == \
+        '<p><div grid></p><p>[flickr:id=999]</p>'
+    assert documents[2]._content == '<p>No photos</p>'
+
+
+def test_generator_documents():
+    article, hidden, page = Document('a'), Document('h'), Document('p')
+    generator = Generator()
+    generator.articles = [article]
+    generator.translations = []
+    generator.hidden_articles = [hidden]
+    generator.pages = [page, article]
+    assert plugin.generator_documents(generator) == [article, hidden, page]
+
+
+class Photo(object):
+
+    def __init__(self, id):
+        self.id = id
+        self.title = 'Photo %s' % id
+        self.url = 'https://www.flickr.com/photos/someone/%s/' % id
+        self.farm, self.server, self.secret = '66', '65535', 'abc'
+
+    def getSizes(self):
+        return SIZES
+
+
+class Api(object):
+    """The parts of the flickr module prefetch_owner_photos uses, listing
+    photos newest first."""
+    EXTRAS_SIZES = flickr.EXTRAS_SIZES
+    REQUEST_ERRORS = flickr.REQUEST_ERRORS
+
+    def __init__(self, owned):
+        self.owned = sorted(owned, key=int, reverse=True)
+        self.listed = 0
+
+    def current_client(self):
+        return flickr.FlickrClient(responses=None, flights=None)
+
+    def photos_search_iter(self, **params):
+        for id in self.owned:
+            self.listed += 1
+            yield Photo(id)
+
+
+def test_prefetch_owner_photos():
+    api = Api([str(id) for id in range(100, 200)])
+    not_listed = set()
+    records = plugin.prefetch_owner_photos(api, ['owner'], ['190', '150'],
+                                           not_listed=not_listed)
+    assert sorted(records) == ['150', '190']
+    assert records['150']['title'] == 'Photo 150'
+    assert records['150']['sizes'] == SIZES
+    assert api.listed == 50
+    assert not_listed == set()
+
+
+def test_prefetch_stops_past_oldest():
+    api = Api([str(id) for id in range(100, 200)])
+    not_listed = set()
+    records = plugin.prefetch_owner_photos(api, ['owner'], ['190', '185'],
+                                           not_listed=not_listed)
+    assert sorted(records) == ['185', '190']
+    api.listed = 0
+    records = plugin.prefetch_owner_photos(api, ['owner'], ['190', '1850'],
+                                           not_listed=not_listed)
+    assert sorted(records) == ['190']
+    # The list goes past 190 only to find 1850 isn't in it
+    assert api.listed == 11
+    assert not_listed == {'1850'}
+
+
+def test_prefetch_failed_list():
+    api = Api(['1'])
+
+    def photos_search_iter(**params):
+        raise flickr.FlickrError('Service unavailable')
+        yield
+    api.photos_search_iter = photos_search_iter
+    not_listed = set()
+    assert plugin.prefetch_owner_photos(api, ['owner'], ['1'],
+                                        not_listed=not_listed) == {}
+    assert not_listed == set()